@@ -0,0 +1,270 @@
+"""
+benchmarks for the request middleware of the limiter.
+
+every scenario registers its routes on a fresh app and calls the request
+middleware directly with lightweight request objects, so the numbers are the
+latency the limiter adds to a request, without the http stack around it.
+
+    python benchmarks/bench_middleware.py
+    python benchmarks/bench_middleware.py --requests 50000 --json bench.json
+    python benchmarks/bench_middleware.py --compare bench.json --tolerance 0.25
+
+redis is benchmarked against ``--redis-url`` if given, otherwise against
+fakeredis when it is installed (``pip install fakeredis[lua]``).
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sanic import Blueprint, Sanic  # noqa: E402
+from sanic.response import text  # noqa: E402
+
+from sanic_limiter import Limiter, RateLimitExceeded  # noqa: E402
+
+
+class BenchRequest(object):
+    """
+    the attributes of :class:`sanic.request.Request` the limiter reads
+    """
+    __slots__ = ("path", "method", "remote_addr", "headers", "args", "ctx")
+
+    def __init__(self, path, remote_addr="127.0.0.1", method="GET"):
+        self.path = path
+        self.method = method
+        self.remote_addr = remote_addr
+        self.headers = {}
+        self.args = {}
+        self.ctx = SimpleNamespace()
+
+
+async def handler(request):
+    return text("ok")
+
+
+def scenario_no_limits(limiter, app):
+    app.add_route(handler, "/plain")
+    return [BenchRequest("/plain")]
+
+
+def scenario_global_limits(limiter, app):
+    app.add_route(handler, "/global")
+    return [BenchRequest("/global")]
+
+
+def scenario_multi_window(limiter, app):
+    app.add_route(
+        limiter.limit("100000000/minute;100000000/hour;100000000/day")(handler),
+        "/multi"
+    )
+    return [BenchRequest("/multi")]
+
+
+def scenario_blueprint(limiter, app):
+    bp = Blueprint("bench_bp")
+    limiter.limit("100000000/hour")(bp)
+
+    @bp.route("/bp")
+    async def bp_handler(request):
+        return text("ok")
+
+    app.blueprint(bp)
+    return [BenchRequest("/bp")]
+
+
+def scenario_dynamic(limiter, app):
+    tiers = ["100000000/hour", "200000000/hour", "300000000/hour"]
+    calls = []
+
+    def tier_limit():
+        calls.append(None)
+        return tiers[len(calls) % len(tiers)]
+
+    app.add_route(limiter.limit(tier_limit)(handler), "/dynamic")
+    return [BenchRequest("/dynamic")]
+
+
+def scenario_high_cardinality(limiter, app):
+    app.add_route(limiter.limit("100000000/hour")(handler), "/cardinality")
+    return [
+        BenchRequest("/cardinality", "10.%d.%d.%d" % (i >> 16 & 255, i >> 8 & 255, i & 255))
+        for i in range(100000)
+    ]
+
+
+# name, Limiter keyword arguments, route setup
+SCENARIOS = [
+    ("no-limits", {}, scenario_no_limits),
+    ("global-limits", {"global_limits": ["100000000/hour", "100000000/day"]},
+     scenario_global_limits),
+    ("multi-window", {}, scenario_multi_window),
+    ("blueprint", {}, scenario_blueprint),
+    ("dynamic", {}, scenario_dynamic),
+    ("high-cardinality", {}, scenario_high_cardinality),
+]
+
+
+def storages(redis_url):
+    yield "memory://", None
+    yield "async+memory://", None
+    yield "async+memory+lru://", None
+    yield "async+shm://" + os.path.join(tempfile.mkdtemp(), "limits"), None
+    if redis_url:
+        yield redis_url, None
+        return
+    try:
+        import fakeredis
+        import lupa  # noqa: F401 the storage runs lua scripts
+        import redis.asyncio
+    except ImportError:
+        return
+    server = fakeredis.FakeServer()
+    yield "async+redis://fakeredis", mock.patch.object(
+        redis.asyncio, "from_url",
+        lambda uri, **options: fakeredis.FakeAsyncRedis(server=server, **options)
+    )
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+async def run_scenario(index, name, limiter_args, setup, storage_uri, patch,
+                       requests, warmup):
+    if patch is None:
+        return await measure_scenario(
+            index, name, limiter_args, setup, storage_uri, requests, warmup
+        )
+    # the storage is built by the listeners, so the patch has to last as
+    # long as the scenario
+    with patch:
+        return await measure_scenario(
+            index, name, limiter_args, setup, storage_uri, requests, warmup
+        )
+
+
+async def run_listeners(app, event, loop):
+    for listener in app.listeners[event]:
+        result = listener(app, loop)
+        if result is not None:
+            await result
+
+
+async def measure_scenario(index, name, limiter_args, setup, storage_uri,
+                           requests, warmup):
+    app = Sanic("bench_%d" % index)
+    limiter = Limiter(app, storage_uri=storage_uri, **limiter_args)
+    bench_requests = setup(limiter, app)
+    middleware = list(app.request_middleware)
+    loop = asyncio.get_event_loop()
+    await run_listeners(app, "before_server_start", loop)
+    clock = time.perf_counter
+    samples = []
+    rejected = 0
+    try:
+        for i in range(warmup + requests):
+            request = bench_requests[i % len(bench_requests)]
+            start = clock()
+            try:
+                for fn in middleware:
+                    result = fn(request)
+                    if result is not None:
+                        await result
+            except RateLimitExceeded:
+                rejected += 1
+            if i >= warmup:
+                samples.append(clock() - start)
+    finally:
+        await run_listeners(app, "before_server_stop", loop)
+        await run_listeners(app, "after_server_stop", loop)
+    total = sum(samples)
+    samples.sort()
+    return {
+        "scenario": name,
+        "storage": storage_uri,
+        "requests": requests,
+        "rejected": rejected,
+        "requests_per_second": requests / total if total else 0.0,
+        "p50_us": percentile(samples, 0.5) * 1e6,
+        "p99_us": percentile(samples, 0.99) * 1e6,
+        "mean_us": total / requests * 1e6,
+    }
+
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path) as baseline_file:
+        baseline = {
+            (r["scenario"], r["storage"]): r
+            for r in json.load(baseline_file)["results"]
+        }
+    regressions = []
+    for result in results:
+        before = baseline.get((result["scenario"], result["storage"]))
+        if before and result["p50_us"] > before["p50_us"] * (1 + tolerance):
+            regressions.append(
+                "%s on %s: p50 %.1fus -> %.1fus" % (
+                    result["scenario"], result["storage"],
+                    before["p50_us"], result["p50_us"]
+                )
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--warmup", type=int, default=1000)
+    parser.add_argument("--scenario", action="append",
+                        help="only run the given scenario(s)")
+    parser.add_argument("--redis-url",
+                        help="asyncio redis storage uri, e.g. async+redis://localhost:6379/15")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare",
+                        help="results of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed relative p50 regression with --compare")
+    args = parser.parse_args(argv)
+
+    loop = asyncio.new_event_loop()
+    results = []
+    print("%-18s %-28s %12s %10s %10s" % ("scenario", "storage", "req/s", "p50 us", "p99 us"))
+    for storage_uri, patch in storages(args.redis_url):
+        for name, limiter_args, setup in SCENARIOS:
+            if args.scenario and name not in args.scenario:
+                continue
+            result = loop.run_until_complete(run_scenario(
+                len(results), name, limiter_args, setup, storage_uri, patch,
+                args.requests, args.warmup
+            ))
+            results.append(result)
+            print("%-18s %-28s %12.0f %10.1f %10.1f" % (
+                name, storage_uri, result["requests_per_second"],
+                result["p50_us"], result["p99_us"]
+            ))
+    loop.close()
+
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump({
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "results": results,
+            }, output, indent=2)
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for regression in regressions:
+            print("regression: %s" % regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,3 @@
 from .errors import RateLimitExceeded
 from .extension import Limiter
-from .util import get_remote_address
+from .util import AddressSet, RemoteAddress, get_remote_address
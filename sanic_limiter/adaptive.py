@@ -0,0 +1,126 @@
+"""
+limits scaled by the load of the worker
+"""
+import asyncio
+
+from .strategies import LimiterWrapper
+
+
+class LoadMonitor(object):
+    """
+    samples the event loop lag and counts the requests in flight of a
+    worker, deriving the factor the limits are scaled by. the factor is
+    multiplied by ``decrease`` after every sample showing overload and
+    grows by ``increase`` after every other sample (additive increase,
+    multiplicative decrease), staying between ``min_factor`` and 1.
+
+    :param float max_lag: seconds of event loop lag from which the worker is
+     overloaded
+    :param int max_in_flight: number of requests in flight from which the
+     worker is overloaded. default ``None``, not considered
+    :param float min_factor: the smallest factor the limits are scaled by
+    :param float interval: seconds between two samples of the lag
+    :param float decrease: the factor is multiplied by on overload
+    :param float increase: added to the factor when not overloaded
+    """
+
+    def __init__(self, max_lag=0.05, max_in_flight=None, min_factor=0.1,
+                 interval=0.5, decrease=0.7, increase=0.05):
+        self.max_lag = max_lag
+        self.max_in_flight = max_in_flight
+        self.min_factor = min_factor
+        self.interval = interval
+        self.decrease = decrease
+        self.increase = increase
+        self.factor = 1.0
+        self.lag = 0.0
+        self.in_flight = 0
+
+    @property
+    def overloaded(self):
+        return self.lag > self.max_lag or bool(
+            self.max_in_flight and self.in_flight > self.max_in_flight
+        )
+
+    def scale(self, amount):
+        """
+        :return: ``amount`` scaled by the factor, at least 1
+        """
+        if self.factor >= 1:
+            return amount
+        return max(1, int(amount * self.factor))
+
+    def update(self):
+        """
+        adjusts the factor to the last sample
+        """
+        if self.overloaded:
+            self.factor = max(self.min_factor, self.factor * self.decrease)
+        else:
+            self.factor = min(1.0, self.factor + self.increase)
+
+    async def run(self):
+        """
+        samples the event loop lag every ``interval`` seconds until
+        cancelled
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, loop.time() - start - self.interval)
+            self.update()
+
+
+class ScaledRateLimitItem(object):
+    """
+    a :class:`limits.RateLimitItem` admitting ``amount`` hits, stored under
+    the keys of ``item`` so the counters are kept when the scale changes
+    """
+    __slots__ = ["item", "amount"]
+
+    def __init__(self, item, amount):
+        self.item = item
+        self.amount = amount
+
+    def get_expiry(self):
+        return self.item.get_expiry()
+
+    def key_for(self, *identifiers):
+        return self.item.key_for(*identifiers)
+
+    def __getattr__(self, name):
+        return getattr(self.item, name)
+
+    def __str__(self):
+        return str(self.item)
+
+
+class AdaptiveLimiter(LimiterWrapper):
+    """
+    wraps a rate limiter, scaling the amount of all limits it is called with
+    by the factor of a :class:`LoadMonitor`, admitting at least one hit.
+    """
+    ITEM_CACHE_SIZE = 1000
+
+    def __init__(self, limiter, monitor):
+        super(AdaptiveLimiter, self).__init__(limiter)
+        self.monitor = monitor
+        self._items = {}
+
+    def item(self, item):
+        """
+        :return: ``item`` or its :class:`ScaledRateLimitItem` while the
+         worker is overloaded
+        """
+        amount = self.monitor.scale(item.amount)
+        if amount == item.amount:
+            return item
+        cache_key = (amount, item.key_for())
+        try:
+            return self._items[cache_key]
+        except KeyError:
+            if len(self._items) >= self.ITEM_CACHE_SIZE:
+                self._items.clear()
+            scaled = self._items[cache_key] = ScaledRateLimitItem(item, amount)
+            return scaled
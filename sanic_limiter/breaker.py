@@ -0,0 +1,54 @@
+"""
+circuit breaker guarding the storage
+"""
+from collections import Counter
+import time
+
+
+class CircuitBreaker(object):
+    """
+    counts consecutive storage failures and opens once ``threshold`` of them
+    happened in a row. while open the storage is not called at all; the
+    extension probes it every ``recovery_interval`` seconds and closes the
+    breaker once it is healthy again.
+
+    :param int threshold: consecutive failures opening the breaker
+    :param float recovery_interval: seconds between two health probes
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+
+    def __init__(self, threshold, recovery_interval=30):
+        self.threshold = threshold
+        self.recovery_interval = recovery_interval
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.transitions = Counter()
+
+    @property
+    def is_open(self):
+        return self.state == self.OPEN
+
+    def success(self):
+        self.failures = 0
+
+    def failure(self):
+        """
+        records a failure.
+
+        :return: True if this failure opened the breaker
+        """
+        self.failures += 1
+        if self.state == self.CLOSED and self.failures >= self.threshold:
+            self.state = self.OPEN
+            self.opened_at = time.time()
+            self.transitions[self.OPEN] += 1
+            return True
+        return False
+
+    def close(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.transitions[self.CLOSED] += 1
@@ -2,19 +2,37 @@
 the sanic extension
 """
 
+import asyncio
+import copy
+import itertools
 import logging
+import math
+import os
+from collections import namedtuple
+from time import perf_counter, time
 import six
 import sys
 import inspect
 
 from limits.errors import ConfigurationError
-from limits.storage import storage_from_string
+from limits.storage import MemoryStorage
 from limits.strategies import STRATEGIES
 from limits.util import parse_many
 from sanic.blueprints import Blueprint
+from sanic.exceptions import SanicException
 
+from .adaptive import AdaptiveLimiter, LoadMonitor
 from .errors import RateLimitExceeded
-from .util import get_remote_address
+from .breaker import CircuitBreaker
+from .keys import CompactKeyLimiter, CompactKeys
+from .metrics import Metrics
+from .sketch import HeavyHitters
+from .storage import (
+    AsyncMemoryStorage, LocalCounterStorage, is_async_storage, is_async_storage_uri,
+    storage_classes, storage_from_string
+)
+from .strategies import STRATEGIES as ASYNC_STRATEGIES
+from .util import AddressSet, RemoteAddress, get_remote_address
 
 
 class C:
@@ -24,6 +42,96 @@ class C:
     STRATEGY = "RATELIMIT_STRATEGY"
     GLOBAL_LIMITS = "RATELIMIT_GLOBAL"
     SWALLOW_ERRORS = "RATELIMIT_SWALLOW_ERRORS"
+    BATCH_HITS = "RATELIMIT_BATCH_HITS"
+    SCOPE_BY_ROUTE = "RATELIMIT_SCOPE_BY_ROUTE"
+    LOCAL_SYNC_INTERVAL = "RATELIMIT_LOCAL_SYNC_INTERVAL"
+    LOCAL_SYNC_HITS = "RATELIMIT_LOCAL_SYNC_HITS"
+    STORAGE_FAILURE_THRESHOLD = "RATELIMIT_STORAGE_FAILURE_THRESHOLD"
+    STORAGE_RECOVERY_INTERVAL = "RATELIMIT_STORAGE_RECOVERY_INTERVAL"
+    IN_MEMORY_FALLBACK_ENABLED = "RATELIMIT_IN_MEMORY_FALLBACK_ENABLED"
+    HEADERS_ENABLED = "RATELIMIT_HEADERS_ENABLED"
+    FILTER_CACHE_TTL = "RATELIMIT_FILTER_CACHE_TTL"
+    REJECTION_CACHE_ENABLED = "RATELIMIT_REJECTION_CACHE_ENABLED"
+    GLOBAL_CONCURRENCY = "RATELIMIT_GLOBAL_CONCURRENCY"
+    CONCURRENCY_LEASE_TTL = "RATELIMIT_CONCURRENCY_LEASE_TTL"
+    ALLOWLIST = "RATELIMIT_ALLOWLIST"
+    DENYLIST = "RATELIMIT_DENYLIST"
+    COMPACT_KEYS = "RATELIMIT_COMPACT_KEYS"
+    HEAVY_HITTERS = "RATELIMIT_HEAVY_HITTERS"
+    HEAVY_HITTER_THRESHOLD = "RATELIMIT_HEAVY_HITTER_THRESHOLD"
+    HEAVY_HITTER_LIMIT = "RATELIMIT_HEAVY_HITTER_LIMIT"
+    HEAVY_HITTER_DECAY_INTERVAL = "RATELIMIT_HEAVY_HITTER_DECAY_INTERVAL"
+    ADAPTIVE_ENABLED = "RATELIMIT_ADAPTIVE_ENABLED"
+    ADAPTIVE_MAX_LAG = "RATELIMIT_ADAPTIVE_MAX_LAG"
+    ADAPTIVE_MAX_IN_FLIGHT = "RATELIMIT_ADAPTIVE_MAX_IN_FLIGHT"
+    ADAPTIVE_MIN_FACTOR = "RATELIMIT_ADAPTIVE_MIN_FACTOR"
+
+
+def _set_request_state(request, name, value):
+    # sanic>=19.9 requests carry a ``ctx`` namespace, older requests are dicts
+    ctx = getattr(request, "ctx", None)
+    if ctx is not None:
+        setattr(ctx, "_sanic_limiter_" + name, value)
+    else:
+        request["_sanic_limiter_" + name] = value
+
+
+def _get_request_state(request, name):
+    ctx = getattr(request, "ctx", None)
+    if ctx is not None:
+        return getattr(ctx, "_sanic_limiter_" + name, None)
+    return request.get("_sanic_limiter_" + name)
+
+
+def _on_request_done(callback):
+    """
+    calls ``callback`` once the task handling the current request is done,
+    also when the task is cancelled because the client disconnected, which
+    skips the response middleware.
+    """
+    if hasattr(asyncio, "current_task"):
+        task = asyncio.current_task()
+    else:
+        task = asyncio.Task.current_task()
+    if task is not None:
+        task.add_done_callback(lambda task: callback())
+
+
+def _view_name(obj):
+    # the route decorators of sanic 19.x return a tuple of the routes and
+    # the view function
+    if isinstance(obj, tuple):
+        obj = obj[1]
+    return "{}.{}".format(obj.__module__, obj.__name__)
+
+
+def key_func_caller(key_func):
+    """
+    :return: a callable taking the request which calls ``key_func`` with the
+     request if its first argument has no default, and without arguments
+     otherwise.
+    """
+    for param in inspect.signature(key_func).parameters.values():
+        if param.default is inspect.Parameter.empty:
+            return key_func
+        break
+    return lambda request: key_func()
+
+
+class Exemption(object):
+    """
+    a request filter or ``exempt_when`` callable. it is called with the
+    request if its first argument has no default and may be a coroutine
+    function. its result is cached per key of ``key_func``.
+    """
+    __slots__ = ["func", "call", "is_async", "key_func", "get_key"]
+
+    def __init__(self, func, key_func):
+        self.func = func
+        self.call = key_func_caller(func)
+        self.is_async = asyncio.iscoroutinefunction(func)
+        self.key_func = key_func
+        self.get_key = key_func_caller(key_func)
 
 
 class ExtLimit(object):
@@ -32,14 +140,29 @@ class ExtLimit(object):
     """
 
     def __init__(self, limit, key_func, scope, per_method, methods, error_message,
-                 exempt_when):
+                 exempt_when, cost=1, max_delay=None, max_queue=None):
         self._limit = limit
         self.key_func = key_func
+        self.get_key = key_func_caller(key_func)
         self._scope = scope
         self.per_method = per_method
         self.methods = methods and [m.lower() for m in methods] or methods
         self.error_message = error_message
         self.exempt_when = exempt_when
+        self.exemption = exempt_when and Exemption(exempt_when, key_func)
+        self.cost = cost
+        self.get_cost = key_func_caller(cost) if callable(cost) else None
+        self.max_delay = max_delay
+        self.max_queue = max_queue
+
+    def with_limit(self, limit):
+        """
+        :return: a copy of this limit sharing its context with ``limit``
+         as limit value
+        """
+        clone = copy.copy(self)
+        clone._limit = limit
+        return clone
 
     @property
     def limit(self):
@@ -49,10 +172,97 @@ class ExtLimit(object):
     def scope(self):
         return self._scope
 
-    @property
-    def is_exempt(self):
-        """Check if the limit is exempt."""
-        return self.exempt_when and self.exempt_when()
+
+class ConcurrencyLimit(object):
+    """
+    caps the number of requests per key which are handled at the same time
+    """
+    __slots__ = ["limit", "key_func", "get_key", "scope", "error_message"]
+
+    def __init__(self, limit, key_func, scope, error_message):
+        self.limit = limit
+        self.key_func = key_func
+        self.get_key = key_func_caller(key_func)
+        self.scope = scope
+        self.error_message = error_message
+
+
+RouteMatch = namedtuple("RouteMatch", ["handler", "uri"])
+# appended to the scope of the heavy hitter limit of a scope
+HEAVY_HITTER_SUFFIX = ":heavy"
+
+
+class PlanEntry(object):
+    """
+    a limit of a :class:`RoutePlan` with its scope resolved for one http method.
+    ``scope`` is None when the limit is scoped by the request path, in which
+    case ``suffix`` is appended to the path. entries of dynamic limits keep
+    the entries parsed from the strings returned by the limit callable in
+    ``expanded``, holding at most ``EXPANDED_CACHE_SIZE`` strings.
+    """
+    __slots__ = ("limit", "scope", "suffix", "dynamic", "expanded")
+    EXPANDED_CACHE_SIZE = 64
+
+    def __init__(self, limit, scope, suffix, dynamic):
+        self.limit = limit
+        self.scope = scope
+        self.suffix = suffix
+        self.dynamic = dynamic
+        self.expanded = {} if dynamic else None
+
+
+class RoutePlan(object):
+    """
+    the limits applying to a view function, resolved once from the route,
+    blueprint and global limits so the request middleware only has to
+    look the plan up and iterate over it.
+    """
+    __slots__ = (
+        "name", "exempt", "static", "dynamic", "limits", "fallback", "concurrency",
+        "_methods"
+    )
+
+    def __init__(self, name, exempt, limits, dynamic_limits, global_limits,
+                 concurrency=()):
+        self.name = name
+        self.exempt = exempt
+        self.concurrency = tuple(concurrency)
+        self.static = bool(limits)
+        self.dynamic = bool(dynamic_limits)
+        self.limits = tuple(limits) + tuple(dynamic_limits) or tuple(global_limits)
+        self.fallback = tuple(global_limits) if self.dynamic and not self.static else ()
+        self._methods = {}
+
+    @staticmethod
+    def _entries(limits, method):
+        entries = []
+        for lim in limits:
+            if lim.methods is not None and method.lower() not in lim.methods:
+                # an unmatched method skips this and all following limits
+                break
+            suffix = ":%s" % method if lim.per_method else ""
+            entries.append(PlanEntry(
+                lim, lim.scope + suffix if lim.scope else None, suffix,
+                callable(lim._limit)
+            ))
+        return tuple(entries)
+
+    def for_method(self, method):
+        """
+        :return: the :class:`PlanEntry` instances to check for ``method``
+        """
+        try:
+            return self._methods[method]
+        except KeyError:
+            entries = self._methods[method] = self._entries(self.limits, method)
+            return entries
+
+    def fallback_for_method(self, method):
+        """
+        :return: the global limits to check for ``method`` when none of the
+         dynamic limits of the view applying to ``method`` could be loaded
+        """
+        return self._entries(self.fallback, method)
 
 
 class Limiter(object):
@@ -61,12 +271,89 @@ class Limiter(object):
     :param list global_limits: a variable list of strings denoting global
      limits to apply to all routes. :ref:`ratelimit-string` for  more details.
     :param function key_func: a callable that returns the key to rate limit by.
-    :param str strategy: the strategy to use. refer to :ref:`ratelimit-strategy`
-    :param str storage_uri: the storage location. refer to :ref:`ratelimit-conf`
+    :param str strategy: the strategy to use. refer to :ref:`ratelimit-strategy`.
+     with an asyncio storage ``gcra`` and ``sliding-window-counter`` are
+     available too, see :mod:`sanic_limiter.strategies`.
+    :param str storage_uri: the storage location. refer to :ref:`ratelimit-conf`.
+     uris prefixed with ``async+`` (e.g. ``async+redis://localhost:6379``) select
+     an asyncio storage which is awaited instead of blocking the event loop.
+     a list of asyncio storage uris spreads the keys over all of them, see
+     :class:`sanic_limiter.storage.AsyncShardedStorage`.
     :param dict storage_options: kwargs to pass to the storage implementation upon instantiation.
     :param bool swallow_errors: whether to swallow errors when hitting a rate limit.
      An exception will still be logged. default ``False``
+    :param bool batch_hits: whether to hit all limits of a request in a single
+     storage call, consuming none of them if one is exceeded. Only takes effect
+     with an asyncio storage. default ``False``
+    :param bool scope_by_route: whether limits which are not shared are scoped
+     by the uri pattern of the route (e.g. ``/user/<id>``) instead of the path
+     of the request, so all urls of a parameterized route share one limit.
+     default ``False``
+    :param float local_sync_interval: if set, hits are counted in process and
+     pushed to the (asyncio) storage at least every ``local_sync_interval``
+     seconds, trading accuracy for fewer storage calls. see
+     :class:`sanic_limiter.storage.LocalCounterStorage`. default ``None``
+    :param int local_sync_hits: maximum number of hits counted in process per
+     limit before they are pushed to the storage. default ``10``
+    :param int storage_failure_threshold: number of consecutive storage errors
+     after which the storage is no longer called until it is healthy again.
+     default ``None`` (never stop calling the storage)
+    :param float storage_recovery_interval: seconds between two health checks
+     of a failed storage. default ``30``
+    :param bool in_memory_fallback_enabled: whether to rate limit with an in
+     memory storage while the storage is failed instead of letting all requests
+     pass. default ``False``
+    :param metrics: a :class:`sanic_limiter.metrics.Metrics` instance collecting
+     counters and latencies of the limit checks, e.g.
+     :class:`sanic_limiter.metrics.PrometheusMetrics`. default: collect nothing
+    :param bool headers_enabled: whether to add ``X-RateLimit-Limit``,
+     ``X-RateLimit-Remaining`` and ``X-RateLimit-Reset`` headers for the limit
+     closest to being exceeded to the responses, and ``Retry-After`` to the
+     responses of rejected requests. default ``False``
+    :param float filter_cache_ttl: if set, the results of request filters and
+     ``exempt_when`` callables are cached for ``filter_cache_ttl`` seconds per
+     key of the key function, so they must only depend on that key.
+     default ``None``
+    :param bool rejection_cache_enabled: whether to remember exceeded limits
+     in process until their reset and reject further requests for them
+     without calling the storage. default ``False``
+    :param int global_concurrency: maximum number of requests per key handled
+     at the same time by every route without a concurrency limit of its own.
+     default ``None``
+    :param float concurrency_lease_ttl: seconds after which a concurrency
+     slot of a request which never finished is released. default ``60``
+    :param allowlist: ip networks (or a :class:`sanic_limiter.util.AddressSet`)
+     of clients exempt from rate limiting. default ``None``
+    :param denylist: ip networks (or a :class:`sanic_limiter.util.AddressSet`)
+     of clients whose requests are always rejected, even if allowlisted.
+     default ``None``
+    :param bool compact_keys: whether to encode the storage keys into a
+     fixed width form of a scope id and a digest of the client key instead
+     of the readable key. default ``False``
+    :param int heavy_hitters: if set, the number of most frequent keys and
+     scopes tracked in a constant memory summary, see :meth:`heavy_hitters`.
+     default ``None``
+    :param int heavy_hitter_threshold: the number of recent hits from which a
+     tracked key and scope is a heavy hitter, whose rejections are logged at
+     debug level. default ``None``
+    :param str heavy_hitter_limit: rate limit string applied in addition to
+     the limits of a route to the heavy hitters. default ``None``
+    :param float heavy_hitter_decay_interval: seconds after which the counts
+     of the summary are halved. default ``60``
+    :param bool adaptive_enabled: whether to scale all limits down while the
+     worker is overloaded and back up once it recovered. default ``False``
+    :param float adaptive_max_lag: seconds of event loop lag from which the
+     worker is overloaded. default ``0.05``
+    :param int adaptive_max_in_flight: number of requests in flight from
+     which the worker is overloaded. default ``None``
+    :param float adaptive_min_factor: the smallest factor the limits are
+     scaled by. default ``0.1``
     """
+    FILTER_CACHE_SIZE = 10000
+    REJECTION_CACHE_SIZE = 10000
+    #: seconds a delayed request waits before hitting the limit again when
+    #: the limit reports no later reset
+    DELAY_POLL_INTERVAL = 0.05
 
     def __init__(self, app=None
                  , key_func=None
@@ -75,6 +362,30 @@ class Limiter(object):
                  , storage_uri=None
                  , storage_options={}
                  , swallow_errors=False
+                 , batch_hits=False
+                 , scope_by_route=False
+                 , local_sync_interval=None
+                 , local_sync_hits=10
+                 , storage_failure_threshold=None
+                 , storage_recovery_interval=30
+                 , in_memory_fallback_enabled=False
+                 , metrics=None
+                 , headers_enabled=False
+                 , filter_cache_ttl=None
+                 , rejection_cache_enabled=False
+                 , global_concurrency=None
+                 , concurrency_lease_ttl=60
+                 , allowlist=None
+                 , denylist=None
+                 , compact_keys=False
+                 , heavy_hitters=None
+                 , heavy_hitter_threshold=None
+                 , heavy_hitter_limit=None
+                 , heavy_hitter_decay_interval=60
+                 , adaptive_enabled=False
+                 , adaptive_max_lag=0.05
+                 , adaptive_max_in_flight=None
+                 , adaptive_min_factor=0.1
                  ):
         self.logger = logging.getLogger("sanic-limiter")
 
@@ -86,6 +397,42 @@ class Limiter(object):
         self._storage_uri = storage_uri
         self._storage_options = storage_options
         self._swallow_errors = swallow_errors
+        self._batch_hits = batch_hits
+        self._scope_by_route = scope_by_route
+        self._local_sync_interval = local_sync_interval
+        self._local_sync_hits = local_sync_hits
+        self._storage_failure_threshold = storage_failure_threshold
+        self._storage_recovery_interval = storage_recovery_interval
+        self._in_memory_fallback_enabled = in_memory_fallback_enabled
+        self.metrics = metrics or Metrics()
+        self._headers_enabled = headers_enabled
+        self._filter_cache_ttl = filter_cache_ttl
+        self._filter_cache = {}
+        self._rejection_cache_enabled = rejection_cache_enabled
+        self._rejections = {}
+        # number of delayed requests waiting per storage key
+        self._queues = {}
+        self._global_concurrency = global_concurrency
+        self._concurrency_lease_ttl = concurrency_lease_ttl
+        self._route_concurrency = {}
+        self._blueprint_concurrency = {}
+        self.__lease_storage = None
+        self._allowlist = allowlist
+        self._denylist = denylist
+        self._compact_keys = compact_keys
+        self._heavy_hitter_size = heavy_hitters
+        self._heavy_hitter_threshold = heavy_hitter_threshold
+        self._heavy_hitter_limit = heavy_hitter_limit
+        self._heavy_hitter_decay_interval = heavy_hitter_decay_interval
+        self._hitters = None
+        self._heavy_hitter_limits = []
+        self._heavy_hitter_ext_limits = {}
+        self._adaptive_enabled = adaptive_enabled
+        self._adaptive_max_lag = adaptive_max_lag
+        self._adaptive_max_in_flight = adaptive_max_in_flight
+        self._adaptive_min_factor = adaptive_min_factor
+        self._load_monitor = None
+        self._background_tasks = []
         self._key_func = key_func or get_remote_address
         for limit in global_limits:
             self._global_limits.extend(
@@ -99,9 +446,17 @@ class Limiter(object):
         self._dynamic_route_limits = {}
         self._blueprint_dynamic_limits = {}
         self._blueprint_limits = {}
-        self._storage = None
+        self._route_plans = {}
+        self.__storage = None
+        self._storage_string = None
+        # the process the storage was built in
+        self._storage_pid = None
+        self._storage_async = False
+        self._strategy_class = None
         self._limiter = None
-        self._storage_dead = False
+        self._breaker = None
+        self._fallback_storage = None
+        self._fallback_limiter = None
 
         class BlackHoleHandler(logging.StreamHandler):
             def emit(*_):
@@ -123,18 +478,67 @@ class Limiter(object):
         self._storage_options.update(
             app.config.get(C.STORAGE_OPTIONS, {})
         )
-        self._storage = storage_from_string(
+        self._storage_string = (
             self._storage_uri
-            or app.config.setdefault(C.STORAGE_URL, 'memory://'),
-            **self._storage_options
+            or app.config.setdefault(C.STORAGE_URL, 'memory://')
         )
         strategy = (
             self._strategy
             or app.config.setdefault(C.STRATEGY, 'fixed-window')
         )
-        if strategy not in STRATEGIES:
+        self._storage_async = is_async_storage_uri(self._storage_string)
+        if isinstance(self._storage_string, (list, tuple)) and not self._storage_async:
+            raise ConfigurationError("sharding requires asyncio storages")
+        self._local_sync_interval = app.config.setdefault(
+            C.LOCAL_SYNC_INTERVAL, self._local_sync_interval
+        )
+        if self._local_sync_interval:
+            if not self._storage_async:
+                raise ConfigurationError(
+                    "local counting requires an asyncio storage"
+                )
+            self._local_sync_hits = app.config.setdefault(
+                C.LOCAL_SYNC_HITS, self._local_sync_hits
+            )
+        strategies = ASYNC_STRATEGIES if self._storage_async else STRATEGIES
+        if strategy in ASYNC_STRATEGIES and strategy not in strategies:
+            raise ConfigurationError(
+                "the %s rate limiting strategy requires an asyncio storage" % strategy
+            )
+        if strategy not in strategies:
             raise ConfigurationError("Invalid rate limiting strategy %s" % strategy)
-        self._limiter = STRATEGIES[strategy](self._storage)
+        if not self._storage_async and any(
+            lim.cost != 1
+            for limits in itertools.chain(
+                self._route_limits.values(), self._dynamic_route_limits.values(),
+                self._blueprint_limits.values(), self._blueprint_dynamic_limits.values()
+            )
+            for lim in limits
+        ):
+            raise ConfigurationError(
+                "hits costing more than one require an asyncio storage"
+            )
+        self._strategy_class = strategies[strategy]
+        self.__check_storage_support(strategy)
+        self._batch_hits = self._storage_async and app.config.setdefault(
+            C.BATCH_HITS, self._batch_hits
+        )
+        self._scope_by_route = app.config.setdefault(
+            C.SCOPE_BY_ROUTE, self._scope_by_route
+        )
+        failure_threshold = app.config.setdefault(
+            C.STORAGE_FAILURE_THRESHOLD, self._storage_failure_threshold
+        )
+        if failure_threshold:
+            self._breaker = CircuitBreaker(
+                failure_threshold,
+                app.config.setdefault(
+                    C.STORAGE_RECOVERY_INTERVAL, self._storage_recovery_interval
+                )
+            )
+            self._in_memory_fallback_enabled = app.config.setdefault(
+                C.IN_MEMORY_FALLBACK_ENABLED, self._in_memory_fallback_enabled
+            )
 
         conf_limits = app.config.get(C.GLOBAL_LIMITS, None)
         if not self._global_limits and conf_limits:
@@ -143,88 +547,798 @@ class Limiter(object):
                     limit, self._key_func, None, False, None, None, None
                 ) for limit in parse_many(conf_limits)
                 ]
+        self._headers_enabled = app.config.setdefault(
+            C.HEADERS_ENABLED, self._headers_enabled
+        )
+        self._filter_cache_ttl = app.config.setdefault(
+            C.FILTER_CACHE_TTL, self._filter_cache_ttl
+        )
+        self._filter_cache.clear()
+        self._rejection_cache_enabled = app.config.setdefault(
+            C.REJECTION_CACHE_ENABLED, self._rejection_cache_enabled
+        )
+        self._rejections.clear()
+        global_concurrency = app.config.setdefault(
+            C.GLOBAL_CONCURRENCY, self._global_concurrency
+        )
+        self._global_concurrency = global_concurrency and [
+            ConcurrencyLimit(global_concurrency, self._key_func, None, None)
+        ]
+        self._concurrency_lease_ttl = app.config.setdefault(
+            C.CONCURRENCY_LEASE_TTL, self._concurrency_lease_ttl
+        )
+        self._allowlist = self.__address_set(
+            app.config.setdefault(C.ALLOWLIST, self._allowlist)
+        )
+        self._denylist = self.__address_set(
+            app.config.setdefault(C.DENYLIST, self._denylist)
+        )
+        self._compact_keys = app.config.setdefault(
+            C.COMPACT_KEYS, self._compact_keys
+        ) and CompactKeys()
+        self._heavy_hitter_size = app.config.setdefault(
+            C.HEAVY_HITTERS, self._heavy_hitter_size
+        )
+        self._heavy_hitter_threshold = app.config.setdefault(
+            C.HEAVY_HITTER_THRESHOLD, self._heavy_hitter_threshold
+        )
+        self._heavy_hitter_limit = app.config.setdefault(
+            C.HEAVY_HITTER_LIMIT, self._heavy_hitter_limit
+        )
+        self._heavy_hitter_decay_interval = app.config.setdefault(
+            C.HEAVY_HITTER_DECAY_INTERVAL, self._heavy_hitter_decay_interval
+        )
+        self._hitters = self._heavy_hitter_size and HeavyHitters(
+            self._heavy_hitter_size, self._heavy_hitter_decay_interval
+        ) or None
+        self._heavy_hitter_limits = (
+            parse_many(self._heavy_hitter_limit)
+            if self._heavy_hitter_limit and self._heavy_hitter_threshold else []
+        )
+        self._heavy_hitter_ext_limits.clear()
+        self._adaptive_enabled = app.config.setdefault(
+            C.ADAPTIVE_ENABLED, self._adaptive_enabled
+        )
+        self._load_monitor = self._adaptive_enabled and LoadMonitor(
+            app.config.setdefault(C.ADAPTIVE_MAX_LAG, self._adaptive_max_lag),
+            app.config.setdefault(
+                C.ADAPTIVE_MAX_IN_FLIGHT, self._adaptive_max_in_flight
+            ),
+            app.config.setdefault(C.ADAPTIVE_MIN_FACTOR, self._adaptive_min_factor)
+        ) or None
+        # the client address of the lists is resolved like the one of the
+        # default key function if that aggregates addresses
+        self._client_address = (
+            self._key_func if isinstance(self._key_func, RemoteAddress)
+            else RemoteAddress()
+        ).client_address
+        # the storage is built again on its first use in each worker
+        self._storage_pid = None
+        self._route_plans.clear()
+        app.listener('before_server_start')(self.__open_storage)
+        app.listener('before_server_start')(self.__compile_route_plans)
+        app.listener('before_server_start')(self.__start_background_tasks)
+        app.listener('before_server_stop')(self.__stop_background_tasks)
+        app.listener('after_server_stop')(self.__close_storage)
+        if self._load_monitor is not None:
+            app.request_middleware.append(self.__enter_request)
+            app.register_middleware(self.__leave_request, "response")
         app.request_middleware.append(self.__check_request_limit)
+        app.request_middleware.append(self.__acquire_concurrency)
+        app.register_middleware(self.__release_concurrency, "response")
+        if self._headers_enabled:
+            app.register_middleware(self.__inject_headers, "response")
+
+    def __check_storage_support(self, strategy):
+        """
+        raises :class:`ConfigurationError` when the storage lacks the
+        operations of ``strategy``, which would only fail once the storage
+        is built on its first use.
+        """
+        # the strategies of limits need the same storage operations as their
+        # asyncio counterparts
+        supports = ASYNC_STRATEGIES[strategy].supports
+        if self._local_sync_interval:
+            if not supports(LocalCounterStorage):
+                raise ConfigurationError(
+                    "the %s rate limiting strategy is not supported with local counting"
+                    % strategy
+                )
+            return
+        for storage_class in storage_classes(self._storage_string):
+            # unknown schemes are reported when the storage is built
+            if storage_class is not None and not supports(storage_class):
+                raise ConfigurationError(
+                    "the %s rate limiting strategy is not supported by %s"
+                    % (strategy, storage_class.__name__)
+                )
+
+    @staticmethod
+    def __address_set(networks):
+        if not networks:
+            return None
+        if isinstance(networks, AddressSet):
+            return networks
+        return AddressSet(networks)
+
+    def __build_storage(self):
+        """
+        builds the storage and the limiters using it. connections must not
+        be shared by forked worker processes, so every process builds its
+        own storage when its server starts or the storage is first used.
+        """
+        storage = storage_from_string(self._storage_string, **self._storage_options)
+        if self._local_sync_interval:
+            storage = LocalCounterStorage(
+                storage, self._local_sync_interval, self._local_sync_hits
+            )
+        self._limiter = self._strategy_class(storage)
+        if self._compact_keys:
+            self._limiter = CompactKeyLimiter(self._limiter, self._compact_keys)
+        if self._load_monitor is not None:
+            self._limiter = AdaptiveLimiter(self._limiter, self._load_monitor)
+        if self._breaker is not None and self._in_memory_fallback_enabled:
+            self._fallback_storage = (
+                AsyncMemoryStorage() if self._storage_async else MemoryStorage()
+            )
+            self._fallback_limiter = self._strategy_class(self._fallback_storage)
+        # storages without leases hold the concurrency slots in process
+        self.__lease_storage = (
+            storage if hasattr(storage, "acquire_lease") else AsyncMemoryStorage()
+        )
+        self.__storage = storage
+        self._storage_pid = os.getpid()
+
+    @property
+    def _storage(self):
+        if self._storage_pid != os.getpid():
+            self.__build_storage()
+        return self.__storage
 
     @property
     def limiter(self):
+        if self._storage_pid != os.getpid():
+            self.__build_storage()
         return self._limiter
 
-    def __check_request_limit(self, request):
-        endpoint = request.path or ""
-        view_handler = self.app.router.routes_static.get(endpoint, None)
-        if view_handler is None:
+    @property
+    def _lease_storage(self):
+        if self._storage_pid != os.getpid():
+            self.__build_storage()
+        return self.__lease_storage
+
+    @property
+    def _storage_dead(self):
+        return self._breaker is not None and self._breaker.is_open
+
+    def __storage_failed(self, limiter):
+        if self.metrics.enabled:
+            self.metrics.storage_error()
+        if (self._breaker is None
+                or limiter is not self._limiter
+                or not self._breaker.failure()):
             return
-        view_func = view_handler.handler
-        view_bpname = view_func.__dict__.get('__blueprintname__', None)
-        name = ("{}.{}".format(view_func.__module__, view_func.__name__) if view_func else "")
-        if (not endpoint
-            or not self.enabled
-            or name in self._exempt_routes
-            or any(fn() for fn in self._request_filters)
-            ):
+        if self.metrics.enabled:
+            self.metrics.breaker_transition(self._breaker.state)
+        self.logger.error(
+            "rate limit storage failed %d times in a row, %s until it recovers",
+            self._breaker.failures,
+            "falling back to in memory limits" if self._fallback_limiter
+            else "skipping rate limits"
+        )
+        self._background_tasks.append(
+            asyncio.ensure_future(self.__probe_storage())
+        )
+
+    async def __probe_storage(self):
+        while self._breaker.is_open:
+            await asyncio.sleep(self._breaker.recovery_interval)
+            try:
+                healthy = self._storage.check()
+                if self._storage_async:
+                    healthy = await healthy
+            except Exception:  # no qa
+                healthy = False
+            if healthy:
+                self._breaker.close()
+                if self.metrics.enabled:
+                    self.metrics.breaker_transition(self._breaker.state)
+                self.logger.info("rate limit storage recovered")
+
+    def __open_storage(self, app, loop):
+        if self._storage_pid != os.getpid():
+            self.__build_storage()
+
+    async def __close_storage(self, app, loop):
+        if self._storage_pid != os.getpid():
             return
-        limits = self._route_limits.get(name, [])
-        dynamic_limits = []
-        if name in self._dynamic_route_limits:
-            for lim in self._dynamic_route_limits[name]:
+        storages = [self.__storage]
+        for storage in (self.__lease_storage, self._fallback_storage):
+            if storage is not None and storage is not self.__storage:
+                storages.append(storage)
+        for storage in storages:
+            if not is_async_storage(storage):
+                continue
+            try:
+                await storage.close()
+            except Exception:  # no qa
+                self.logger.exception("Failed to close the rate limit storage")
+
+    def __compile_route_plans(self, app, loop):
+        for route in app.router.routes_all.values():
+            self.__route_plan(route.handler)
+
+    def __start_background_tasks(self, app, loop):
+        if isinstance(self._storage, LocalCounterStorage):
+            self._background_tasks.append(
+                loop.create_task(self.__sync_local_counters())
+            )
+        if self._storage_dead:
+            self._background_tasks.append(
+                loop.create_task(self.__probe_storage())
+            )
+        if self._load_monitor is not None:
+            self._background_tasks.append(
+                loop.create_task(self._load_monitor.run())
+            )
+
+    def __enter_request(self, request):
+        self._load_monitor.in_flight += 1
+        _set_request_state(request, "in_flight", True)
+        # a cancelled request skips the response middleware
+        _on_request_done(lambda: self.__leave_request(request, None))
+
+    def __leave_request(self, request, response):
+        if _get_request_state(request, "in_flight"):
+            _set_request_state(request, "in_flight", False)
+            self._load_monitor.in_flight -= 1
+
+    async def __stop_background_tasks(self, app, loop):
+        for task in self._background_tasks:
+            task.cancel()
+        self._background_tasks = []
+        if isinstance(self._storage, LocalCounterStorage):
+            await self._storage.sync()
+
+    async def __sync_local_counters(self):
+        while True:
+            await asyncio.sleep(self._storage.sync_interval)
+            try:
+                await self._storage.sync()
+            except Exception:  # no qa
+                self.logger.exception("Failed to sync local rate limit counters")
+
+    def __route_plan(self, view_func):
+        plan = self._route_plans.get(view_func)
+        if plan is None:
+            name = "{}.{}".format(view_func.__module__, view_func.__name__)
+            bpname = view_func.__dict__.get('__blueprintname__', None)
+            limits = self._route_limits.get(name, [])
+            dynamic_limits = self._dynamic_route_limits.get(name, [])
+            if bpname:
+                limits = limits or self._blueprint_limits.get(bpname, [])
+                dynamic_limits = (
+                    dynamic_limits
+                    or self._blueprint_dynamic_limits.get(bpname, [])
+                )
+            exempt = name in self._exempt_routes
+            concurrency = self._route_concurrency.get(name, [])
+            if bpname:
+                concurrency = (
+                    concurrency or self._blueprint_concurrency.get(bpname, [])
+                )
+            if not concurrency and not exempt:
+                concurrency = self._global_concurrency or []
+            plan = self._route_plans[view_func] = RoutePlan(
+                name, exempt, limits, dynamic_limits, self._global_limits,
+                concurrency
+            )
+        return plan
+
+    def __expand_dynamic_limit(self, entry, plan):
+        limit_value = entry.limit.limit
+        try:
+            return entry.expanded[limit_value]
+        except KeyError:
+            pass
+        try:
+            expanded = tuple(
+                PlanEntry(entry.limit.with_limit(limit), entry.scope, entry.suffix, False)
+                for limit in parse_many(limit_value)
+            )
+        except ValueError as e:
+            # invalid strings are cached too, so they are only logged once
+            self.logger.error(
+                "failed to load ratelimit for view function %s (%s)"
+                , plan.name, e
+            )
+            expanded = ()
+        if len(entry.expanded) >= entry.EXPANDED_CACHE_SIZE:
+            entry.expanded.clear()
+        entry.expanded[limit_value] = expanded
+        return expanded
+
+    def __resolve_route(self, request):
+        """
+        :return: the route handling ``request`` or None if there is none.
+        """
+        # sanic>=21 routes the request before running the middleware
+        route = getattr(request, "route", None)
+        if route is not None:
+            return route
+        # the router caches its lookups, so the lookup sanic does after the
+        # request middleware is answered from that cache
+        try:
+            match = self.app.router.get(request)
+        except SanicException:
+            return None
+        # (handler, args, kwargs, uri) before sanic 19.9, the name of the
+        # route is appended from then on
+        return RouteMatch(match[0], match[3])
+
+    async def __is_exempt(self, request, exemptions, keys):
+        """
+        runs the synchronous ``exemptions`` one after another and the
+        coroutines concurrently, answering from the cache where possible.
+
+        :return: True if any of ``exemptions`` exempts the request
+        """
+        ttl = self._filter_cache_ttl
+        cache = self._filter_cache
+        now = time() if ttl else None
+        pending = []
+        for exemption in exemptions:
+            cache_key = None
+            if ttl:
                 try:
-                    dynamic_limits.extend(
-                        ExtLimit(
-                            limit, lim.key_func, lim.scope, lim.per_method,
-                            lim.methods, lim.error_message, lim.exempt_when
-                        ) for limit in parse_many(lim.limit)
-                    )
-                except ValueError as e:
-                    self.logger.error(
-                        "failed to load ratelimit for view function %s (%s)"
-                        , name, e
+                    key = keys[exemption.key_func]
+                except KeyError:
+                    key = keys[exemption.key_func] = exemption.get_key(request)
+                cache_key = exemption, key
+                cached = cache.get(cache_key)
+                if cached is not None and cached[1] > now:
+                    if cached[0]:
+                        return True
+                    continue
+            if exemption.is_async:
+                pending.append((cache_key, exemption))
+                continue
+            result = exemption.call(request)
+            if inspect.isawaitable(result):
+                result = await result
+            result = bool(result)
+            if cache_key is not None:
+                self.__cache_exemption(cache_key, result, now)
+            if result:
+                return True
+        if not pending:
+            return False
+        results = await asyncio.gather(
+            *(exemption.call(request) for _, exemption in pending)
+        )
+        exempt = False
+        for (cache_key, _), result in zip(pending, results):
+            result = bool(result)
+            if cache_key is not None:
+                self.__cache_exemption(cache_key, result, now)
+            exempt = exempt or result
+        return exempt
+
+    def __cache_exemption(self, cache_key, result, now):
+        if len(self._filter_cache) >= self.FILTER_CACHE_SIZE:
+            self._filter_cache.clear()
+        self._filter_cache[cache_key] = result, now + self._filter_cache_ttl
+
+    def __cached_rejection(self, request, entries, endpoint, keys):
+        """
+        :return: tuple (limit, key, scope, reset) of the first limit of
+         ``entries`` known to be exceeded, or None.
+        """
+        now = time()
+        rejections = self._rejections
+        for entry in entries:
+            lim = entry.limit
+            try:
+                key = keys[lim.key_func]
+            except KeyError:
+                key = keys[lim.key_func] = lim.get_key(request)
+            if key is None:
+                continue
+            limit_scope = entry.scope or endpoint + entry.suffix
+            storage_key = lim.limit.key_for(key, limit_scope)
+            reset = rejections.get(storage_key)
+            if reset is None:
+                continue
+            if reset > now:
+                return lim, key, limit_scope, reset
+            del rejections[storage_key]
+        return None
+
+    async def __cache_rejection(self, limiter, failed, window):
+        lim, key, limit_scope = failed
+        if window is not None:
+            # with headers enabled the window is the one of the exceeded limit
+            reset = window[1]
+        else:
+            try:
+                stats = limiter.get_window_stats(lim.limit, key, limit_scope)
+                if self._storage_async:
+                    stats = await stats
+            except Exception:  # no qa
+                self.logger.exception("Failed to read the reset of an exceeded limit")
+                return
+            reset = stats[0]
+        if len(self._rejections) >= self.REJECTION_CACHE_SIZE:
+            self._rejections.clear()
+        self._rejections[lim.limit.key_for(key, limit_scope)] = reset
+
+    async def __hit(self, limiter, lim, key, limit_scope, cost, headers):
+        """
+        :return: tuple (hit successful (bool), reset time, remaining), reset
+         time and remaining are None unless ``headers`` is True.
+        """
+        try:
+            if headers:
+                if self._storage_async:
+                    return await limiter.hit_with_stats(
+                        lim.limit, key, limit_scope, cost=cost
                     )
-        if view_bpname:
-            if view_bpname in self._blueprint_dynamic_limits and not dynamic_limits:
-                for lim in self._blueprint_dynamic_limits[view_bpname]:
+                allowed = limiter.hit(lim.limit, key, limit_scope)
+                reset, remaining = limiter.get_window_stats(
+                    lim.limit, key, limit_scope
+                )
+                return allowed, reset, remaining
+            if self._storage_async:
+                allowed = await limiter.hit(lim.limit, key, limit_scope, cost=cost)
+            else:
+                allowed = limiter.hit(lim.limit, key, limit_scope)
+            return allowed, None, None
+        except Exception:  # no qa
+            self.__storage_failed(limiter)
+            raise
+
+    async def __delay(self, limiter, failed, reset, retry, exceeded):
+        """
+        lets a request exceeding a limit with ``max_delay`` wait for the limit
+        to admit it, as long as the next reset of the limit is within
+        ``max_delay`` and fewer than ``max_queue`` requests of the key are
+        already waiting in this worker. when the retry exceeds another limit
+        with ``max_delay`` the request waits for that one instead.
+
+        :param tuple failed: the exceeded limit, its key and scope
+        :param reset: the reset time of the limit if known
+        :param retry: coroutine function hitting the limits again
+        :param exceeded: function returning a tuple of the limit, key and
+         scope exceeded by a result of ``retry`` and the reset time of the
+         limit if known, None if the result was admitted
+        :return: the result of ``retry`` once it was admitted or exceeded a
+         limit without ``max_delay``, None if the request has to be rejected
+        """
+        start = time()
+        queued = None
+        try:
+            while True:
+                lim, key, limit_scope = failed
+                storage_key = lim.limit.key_for(key, limit_scope)
+                if storage_key != queued:
+                    waiting = self._queues.get(storage_key, 0)
+                    if lim.max_queue is not None and waiting >= lim.max_queue:
+                        return None
+                    self.__dequeue(queued)
+                    self._queues[storage_key] = waiting + 1
+                    queued = storage_key
+                if reset is None:
                     try:
-                        dynamic_limits.extend(
-                            ExtLimit(
-                                limit, lim.key_func, lim.scope, lim.per_method,
-                                lim.methods, lim.error_message, lim.exempt_when
-                            ) for limit in parse_many(lim.limit)
-                        )
-                    except ValueError as e:
-                        self.logger.error(
-                            "failed to load ratelimit for view blueprint %s (%s)"
-                            , view_bpname, e
-                        )
-            if view_bpname in self._blueprint_limits and not limits:
-                limits.extend(self._blueprint_limits[view_bpname])
-        failed_limit = None
+                        stats = limiter.get_window_stats(lim.limit, key, limit_scope)
+                        if self._storage_async:
+                            stats = await stats
+                    except Exception:  # no qa
+                        self.__storage_failed(limiter)
+                        raise
+                    reset = stats[0]
+                now = time()
+                wait = max(reset - now, self.DELAY_POLL_INTERVAL)
+                if now + wait > start + lim.max_delay:
+                    return None
+                await asyncio.sleep(wait)
+                # a rejected hit still counts and pushes out the window of
+                # elastic expiry, so the limit is only hit once it admits
+                try:
+                    admits = limiter.test(lim.limit, key, limit_scope)
+                    if self._storage_async:
+                        admits = await admits
+                except Exception:  # no qa
+                    self.__storage_failed(limiter)
+                    raise
+                if not admits:
+                    reset = None
+                    continue
+                result = await retry()
+                waited = exceeded(result)
+                if waited is None:
+                    if self.metrics.enabled:
+                        self.metrics.delayed(limit_scope, time() - start)
+                    return result
+                failed, reset = waited
+                if not failed[0].max_delay:
+                    return result
+        finally:
+            self.__dequeue(queued)
+
+    def __dequeue(self, storage_key):
+        if storage_key is None:
+            return
+        waiting = self._queues.pop(storage_key) - 1
+        if waiting:
+            self._queues[storage_key] = waiting
+
+    def __track_heavy_hitters(self, request, entries, endpoint, keys):
+        """
+        counts the keys and scopes of ``entries`` in the heavy hitter summary.
+
+        :return: ``entries`` followed by entries of the heavy hitter limit
+         for the keys and scopes exceeding the heavy hitter threshold
+        """
+        heavy = []
+        tracked = []
+        for entry in entries:
+            lim = entry.limit
+            try:
+                key = keys[lim.key_func]
+            except KeyError:
+                key = keys[lim.key_func] = lim.get_key(request)
+            if key is None:
+                continue
+            limit_scope = entry.scope or endpoint + entry.suffix
+            if (key, limit_scope) in tracked:
+                continue
+            tracked.append((key, limit_scope))
+            estimate = self._hitters.add((key, limit_scope))
+            if self._heavy_hitter_limits and estimate >= self._heavy_hitter_threshold:
+                try:
+                    ext_limits = self._heavy_hitter_ext_limits[lim.key_func]
+                except KeyError:
+                    ext_limits = self._heavy_hitter_ext_limits[lim.key_func] = [
+                        ExtLimit(limit, lim.key_func, None, False, None, None, None)
+                        for limit in self._heavy_hitter_limits
+                    ]
+                heavy.extend(
+                    PlanEntry(ext_limit, limit_scope + HEAVY_HITTER_SUFFIX, "", False)
+                    for ext_limit in ext_limits
+                )
+        return tuple(entries) + tuple(heavy) if heavy else entries
+
+    def heavy_hitters(self, n=10):
+        """
+        :param int n: the number of heavy hitters
+        :return: list of tuples (key, scope, estimated recent hits) of the
+         ``n`` keys and scopes hitting the limits most, most frequent first.
+         empty unless ``heavy_hitters`` is set.
+        """
+        if self._hitters is None:
+            return []
+        return [
+            (key, scope, count)
+            for (key, scope), count in self._hitters.most_common(n)
+        ]
+
+    async def __check_request_limit(self, request):
+        if not self.enabled:
+            return
+        route = self.__resolve_route(request)
+        if route is None:
+            return
+        endpoint = (route.uri if self._scope_by_route else request.path) or ""
+        plan = self.__route_plan(route.handler)
+        # key functions shared by several limits are only called once
+        keys = {}
+        if plan.concurrency:
+            # the concurrency slots are acquired by the next middleware
+            _set_request_state(request, "plan", (plan, endpoint, keys))
+        metrics = self.metrics if self.metrics.enabled else None
+        if plan.exempt:
+            if metrics is not None:
+                metrics.exempt(plan.name)
+            return
+        if self._denylist is not None or self._allowlist is not None:
+            address = self._client_address(request)
+            if self._denylist is not None and address in self._denylist:
+                if metrics is not None:
+                    metrics.rejected(endpoint)
+                self.logger.warning(
+                    "denied address %s at endpoint: %s", address, endpoint
+                )
+                raise RateLimitExceeded("denied")
+            if self._allowlist is not None and address in self._allowlist:
+                if metrics is not None:
+                    metrics.exempt(plan.name)
+                return
+        entries = plan.for_method(request.method)
+        if plan.dynamic:
+            resolved = []
+            for entry in entries:
+                if entry.dynamic:
+                    resolved.extend(self.__expand_dynamic_limit(entry, plan))
+                else:
+                    resolved.append(entry)
+            if not resolved and entries and not plan.static:
+                # the dynamic limits applying to the method resolved to no
+                # limit, a method they are not declared for is not limited
+                resolved = plan.fallback_for_method(request.method)
+            entries = resolved
+        exemptions = [
+            entry.limit.exemption for entry in entries if entry.limit.exemption
+        ]
+        if self._request_filters:
+            exemptions = self._request_filters + exemptions
+        if exemptions and await self.__is_exempt(request, exemptions, keys):
+            if metrics is not None:
+                metrics.exempt(plan.name)
+            return
+        if self._hitters is not None:
+            entries = self.__track_heavy_hitters(request, entries, endpoint, keys)
+        limiter = self.limiter
+        if self._storage_dead:
+            limiter = self._fallback_limiter
+            if limiter is None:
+                return
+        failed = None
+        headers = self._headers_enabled
+        # (amount, reset, remaining) of the limit closest to being exceeded
+        window = None
+        batch = []
+        costs = []
+        cost = 1
+        cached = None
         try:
-            for lim in (limits + dynamic_limits or self._global_limits):
-                limit_scope = lim.scope or endpoint
-                if lim.is_exempt:
-                    return
-                if lim.methods is not None and request.method.lower() not in lim.methods:
-                    return
-                if lim.per_method:
-                    limit_scope += ":%s" % request.method
-                for param in inspect.signature(lim.key_func).parameters.values():
-                    if param.default is inspect.Parameter.empty:
-                        key = lim.key_func(request)
+            if self._rejections:
+                cached = self.__cached_rejection(request, entries, endpoint, keys)
+                if cached is not None:
+                    failed = cached[:3]
+                    if headers:
+                        window = (
+                            self.__limit_amount(limiter, cached[0].limit), cached[3], 0
+                        )
+                    entries = ()
+            for entry in entries:
+                lim = entry.limit
+                limit_scope = entry.scope or endpoint + entry.suffix
+                try:
+                    key = keys[lim.key_func]
+                except KeyError:
+                    if metrics is not None:
+                        start = perf_counter()
+                        key = keys[lim.key_func] = lim.get_key(request)
+                        metrics.observe_key(perf_counter() - start)
                     else:
-                        key = lim.key_func()
-                    break
-                else:
-                    key = lim.key_func()
+                        key = keys[lim.key_func] = lim.get_key(request)
                 if key is None:
                     # Ignore empty result of the key function.
                     continue
-                if not self.limiter.hit(lim.limit, key, limit_scope):
+                cost = lim.get_cost(request) if lim.get_cost else lim.cost
+                if cost < 0:
+                    # a negative cost would take hits back from the counter
                     self.logger.warning(
-                        "ratelimit %s (%s) exceeded at endpoint: %s",
-                        lim.limit, key, limit_scope)
-                    failed_limit = lim
+                        "negative cost %s (%s) rejected at endpoint: %s",
+                        cost, key, limit_scope)
+                    raise RateLimitExceeded("invalid cost")
+                if self._batch_hits:
+                    batch.append((lim, key, limit_scope))
+                    costs.append(cost)
+                    continue
+                if metrics is not None:
+                    start = perf_counter()
+                allowed, reset, remaining = await self.__hit(
+                    limiter, lim, key, limit_scope, cost, headers
+                )
+                if metrics is not None:
+                    metrics.observe_storage(perf_counter() - start)
+                    if allowed:
+                        metrics.hit(limit_scope)
+                if not allowed and lim.max_delay:
+                    async def retry(lim=lim, key=key, limit_scope=limit_scope, cost=cost):
+                        return await self.__hit(
+                            limiter, lim, key, limit_scope, cost, headers
+                        )
+
+                    def exceeded(result, failed=(lim, key, limit_scope)):
+                        return None if result[0] else (failed, result[1])
+
+                    result = await self.__delay(
+                        limiter, (lim, key, limit_scope), reset, retry, exceeded
+                    )
+                    if result is not None:
+                        allowed, reset, remaining = result
+                        if metrics is not None:
+                            metrics.hit(limit_scope)
+                if headers and (
+                    window is None or not allowed or remaining < window[2]
+                ):
+                    window = self.__limit_amount(limiter, lim.limit), reset, remaining
+                if not allowed:
+                    failed = lim, key, limit_scope
                     break
+            if batch:
+                if metrics is not None:
+                    start = perf_counter()
+                hits = [
+                    (lim.limit, (key, limit_scope)) for lim, key, limit_scope in batch
+                ]
+
+                async def hit_batch():
+                    try:
+                        if headers:
+                            # the windows are returned by the batched call
+                            return await limiter.hit_many_with_stats(hits, costs)
+                        return await limiter.hit_many(hits, costs), None
+                    except Exception:  # no qa
+                        self.__storage_failed(limiter)
+                        raise
+
+                index, stats = await hit_batch()
+                if index is not None and batch[index][0].max_delay:
+                    if metrics is not None:
+                        metrics.observe_storage(perf_counter() - start)
 
-            if failed_limit:
+                    def exceeded(result):
+                        index, stats = result
+                        if index is None:
+                            return None
+                        return batch[index], stats[index][0] if stats else None
+
+                    # storages hitting the batch atomically consumed nothing,
+                    # so the whole batch is hit again
+                    waited, reset = exceeded((index, stats))
+                    result = await self.__delay(
+                        limiter, waited, reset, hit_batch, exceeded
+                    )
+                    if result is not None:
+                        index, stats = result
+                    if metrics is not None:
+                        start = perf_counter()
+                if stats:
+                    for position in range(len(batch)) if index is None else [index]:
+                        reset, remaining = stats[position]
+                        if window is None or index is not None or remaining < window[2]:
+                            window = (
+                                self.__limit_amount(limiter, batch[position][0].limit),
+                                reset, remaining
+                            )
+                if index is not None:
+                    failed = batch[index]
+                    cost = costs[index]
+                if metrics is not None:
+                    metrics.observe_storage(perf_counter() - start)
+                    if index is None:
+                        for _, _, limit_scope in batch:
+                            metrics.hit(limit_scope)
+            if self._breaker is not None and cached is None:
+                self._breaker.success()
+            if window is not None:
+                _set_request_state(request, "window", window)
+
+            if failed:
+                failed_limit, key, limit_scope = failed
+                # a rejected costly hit does not mean a single hit is rejected
+                if (
+                    self._rejection_cache_enabled and cached is None and cost == 1
+                    and not failed_limit.max_delay
+                ):
+                    await self.__cache_rejection(limiter, failed, window)
+                if metrics is not None:
+                    metrics.rejected(limit_scope)
+                log = self.logger.warning
+                if self._heavy_hitter_threshold and self._hitters is not None and (
+                    self._hitters.top.get((
+                        key, limit_scope[:-len(HEAVY_HITTER_SUFFIX)]
+                        if limit_scope.endswith(HEAVY_HITTER_SUFFIX) else limit_scope
+                    ), 0) >= self._heavy_hitter_threshold
+                ):
+                    # heavy hitters are reported by heavy_hitters()
+                    log = self.logger.debug
+                log(
+                    "ratelimit %s (%s) exceeded at endpoint: %s",
+                    failed_limit.limit, key, limit_scope)
                 if failed_limit.error_message:
                     exc_description = failed_limit.error_message if not callable(
                         failed_limit.error_message
@@ -242,28 +1356,140 @@ class Limiter(object):
             else:
                 six.reraise(*sys.exc_info())
 
+    @staticmethod
+    def __limit_amount(limiter, limit):
+        # the amount the limit is hit with, scaled by the adaptive limiter
+        # while the worker is overloaded
+        if isinstance(limiter, AdaptiveLimiter):
+            return limiter.item(limit).amount
+        return limit.amount
+
+    def __inject_headers(self, request, response):
+        window = _get_request_state(request, "window")
+        if window is None or response is None:
+            return
+        amount, reset, remaining = window
+        response.headers["X-RateLimit-Limit"] = str(amount)
+        response.headers["X-RateLimit-Remaining"] = str(remaining)
+        response.headers["X-RateLimit-Reset"] = str(int(reset))
+        if response.status == 429:
+            response.headers["Retry-After"] = str(
+                max(0, int(math.ceil(reset - time())))
+            )
+
+    async def __acquire_concurrency(self, request):
+        state = _get_request_state(request, "plan")
+        if state is None:
+            return
+        plan, endpoint, keys = state
+        leases = []
+        try:
+            for conc in plan.concurrency:
+                try:
+                    key = keys[conc.key_func]
+                except KeyError:
+                    key = keys[conc.key_func] = conc.get_key(request)
+                if key is None:
+                    continue
+                scope = conc.scope or endpoint
+                lease_key = "LIMITER/concurrency/%s/%s" % (key, scope)
+                if self._compact_keys:
+                    lease_key = self._compact_keys.encode(
+                        lease_key, key, "concurrency", scope
+                    )
+                lease = await self._lease_storage.acquire_lease(
+                    lease_key, conc.limit, self._concurrency_lease_ttl
+                )
+                if lease is None:
+                    await self.__release_leases(leases)
+                    leases = []
+                    if self.metrics.enabled:
+                        self.metrics.rejected(scope)
+                    self.logger.warning(
+                        "concurrency limit %d (%s) exceeded at endpoint: %s",
+                        conc.limit, key, scope
+                    )
+                    if conc.error_message:
+                        raise RateLimitExceeded(
+                            conc.error_message if not callable(conc.error_message)
+                            else conc.error_message()
+                        )
+                    raise RateLimitExceeded(
+                        "%d concurrent requests" % conc.limit
+                    )
+                leases.append((lease_key, lease))
+        except Exception as e:  # no qa
+            if isinstance(e, RateLimitExceeded):
+                six.reraise(*sys.exc_info())
+            await self.__release_leases(leases)
+            leases = []
+            if self._swallow_errors:
+                self.logger.exception(
+                    "Failed to acquire a concurrency slot. Swallowing error"
+                )
+            else:
+                six.reraise(*sys.exc_info())
+        finally:
+            if leases:
+                _set_request_state(request, "leases", leases)
+                _on_request_done(lambda: self.__abandon_leases(request))
+
+    async def __release_leases(self, leases):
+        for lease_key, lease in leases:
+            try:
+                await self._lease_storage.release_lease(lease_key, lease)
+            except Exception:  # no qa
+                # the lease expires after its ttl
+                self.logger.exception("Failed to release a concurrency slot")
+
+    async def __release_concurrency(self, request, response):
+        leases = _get_request_state(request, "leases")
+        if leases:
+            _set_request_state(request, "leases", None)
+            await self.__release_leases(leases)
+
+    def __abandon_leases(self, request):
+        # the leases of a request cancelled before its response are
+        # released here instead of holding the slots until their ttl
+        leases = _get_request_state(request, "leases")
+        if leases:
+            _set_request_state(request, "leases", None)
+            asyncio.ensure_future(self.__release_leases(leases))
+
     def __limit_decorator(self, limit_value,
                           key_func=None, shared=False,
                           scope=None,
                           per_method=False,
                           methods=None,
                           error_message=None,
-                          exempt_when=None):
+                          exempt_when=None,
+                          cost=1,
+                          max_delay=None,
+                          max_queue=None):
         _scope = scope if shared else None
+        if not callable(cost) and cost < 0:
+            raise ConfigurationError("the cost of a hit must not be negative")
+        if cost != 1 and self._storage_string is not None and not self._storage_async:
+            raise ConfigurationError(
+                "hits costing more than one require an asyncio storage"
+            )
 
         def _inner(obj):
+            self._route_plans.clear()
             func = key_func or self._key_func
             is_bp = True if isinstance(obj, Blueprint) else False
-            name = "{}.{}".format(obj.__module__, obj.__name__) if not is_bp else obj.name
+            name = _view_name(obj) if not is_bp else obj.name
             dynamic_limit, static_limits = None, []
             if callable(limit_value):
                 dynamic_limit = ExtLimit(limit_value, func, _scope, per_method,
-                                         methods, error_message, exempt_when)
+                                         methods, error_message, exempt_when, cost,
+                                         max_delay, max_queue)
             else:
                 try:
                     static_limits = [ExtLimit(
                         limit, func, _scope, per_method,
-                        methods, error_message, exempt_when
+                        methods, error_message, exempt_when, cost,
+                        max_delay, max_queue
                     ) for limit in parse_many(limit_value)]
                 except ValueError as e:
                     self.logger.error("failed to configure {} {} ({})".format("view function", name, e))
@@ -290,7 +1516,8 @@ class Limiter(object):
         return _inner
 
     def limit(self, limit_value, key_func=None, per_method=False,
-              methods=None, error_message=None, exempt_when=None):
+              methods=None, error_message=None, exempt_when=None, cost=1,
+              max_delay=None, max_queue=None):
         """
         decorator to be used for rate limiting individual routes.
 
@@ -304,14 +1531,29 @@ class Limiter(object):
          limited (default: None).
         :param error_message: string (or callable that returns one) to override the
          error message used in the response.
+        :param exempt_when: function (or coroutine function), optionally taking
+         the request, returning True if the request is exempt from rate limiting.
+         it exempts the request from every limit of the route, not only this one.
+        :param cost: the number of hits a request consumes, or a function
+         (optionally taking the request) returning it. costs other than 1
+         require an asyncio storage and must not be negative; a request whose
+         cost function returns a negative cost is rejected.
+        :param float max_delay: if set, a request exceeding the limit waits up
+         to this many seconds for the limit to admit it instead of being
+         rejected right away.
+        :param int max_queue: the number of requests per key a worker lets
+         wait for the limit at the same time, further requests are rejected.
+         default unbounded.
         :return:
         """
         return self.__limit_decorator(limit_value, key_func, per_method=per_method,
                                       methods=methods, error_message=error_message,
-                                      exempt_when=exempt_when)
+                                      exempt_when=exempt_when, cost=cost,
+                                      max_delay=max_delay, max_queue=max_queue)
 
     def shared_limit(self, limit_value, scope, key_func=None,
-                     error_message=None, exempt_when=None):
+                     error_message=None, exempt_when=None, cost=1,
+                     max_delay=None, max_queue=None):
         """
         decorator to be applied to multiple routes sharing the same rate limit.
 
@@ -323,35 +1565,93 @@ class Limiter(object):
          the rate limit. defaults to remote address of the request.
         :param error_message: string (or callable that returns one) to override the
          error message used in the response.
+        :param exempt_when: function (or coroutine function), optionally taking
+         the request, returning True if the request is exempt from rate limiting.
+         it exempts the request from every limit of the route, not only this one.
+        :param cost: the number of hits a request consumes, or a function
+         (optionally taking the request) returning it. costs other than 1
+         require an asyncio storage and must not be negative; a request whose
+         cost function returns a negative cost is rejected.
+        :param float max_delay: if set, a request exceeding the limit waits up
+         to this many seconds for the limit to admit it instead of being
+         rejected right away.
+        :param int max_queue: the number of requests per key a worker lets
+         wait for the limit at the same time, further requests are rejected.
+         default unbounded.
         """
         return self.__limit_decorator(
             limit_value, key_func, True, scope, error_message=error_message,
-            exempt_when=exempt_when
+            exempt_when=exempt_when, cost=cost, max_delay=max_delay,
+            max_queue=max_queue
         )
 
+    def concurrency_limit(self, limit, key_func=None, scope=None, error_message=None):
+        """
+        decorator limiting the number of requests per key a route, or every
+        route of a blueprint, handles at the same time. the slot of a request
+        is released when its response is sent or the request is cancelled,
+        or after the lease ttl if the request never finished.
+
+        :param int limit: the number of requests handled at the same time
+        :param function key_func: function/lambda to extract the unique identifier for
+         the limit. defaults to remote address of the request.
+        :param str scope: a scope shared by all routes using it. defaults to
+         the request path (or route with ``scope_by_route``).
+        :param error_message: string (or callable that returns one) to override the
+         error message used in the response.
+        """
+
+        def _inner(obj):
+            self._route_plans.clear()
+            conc = ConcurrencyLimit(
+                limit, key_func or self._key_func, scope, error_message
+            )
+            if isinstance(obj, Blueprint):
+                self._blueprint_concurrency.setdefault(obj.name, []).append(conc)
+            else:
+                name = _view_name(obj)
+                self._route_concurrency.setdefault(name, []).append(conc)
+                return obj
+
+        return _inner
+
     def exempt(self, obj):
         """
         decorator to mark a view as exempt from global rate limits.
         """
-        name = "{}.{}".format(obj.__module__, obj.__name__)
+        name = _view_name(obj)
 
         self._exempt_routes.add(name)
+        self._route_plans.clear()
         return obj
 
     def request_filter(self, fn):
         """
         decorator to mark a function as a filter to be executed
         to check if the request is exempt from rate limiting.
+        the function may take the request and may be a coroutine function,
+        coroutine filters of a request run concurrently.
         """
-        self._request_filters.append(fn)
+        self._request_filters.append(Exemption(fn, self._key_func))
         return fn
 
     def reset(self):
         """
-        resets the storage if it supports being reset
+        resets the storage if it supports being reset.
+        with an asyncio storage the returned coroutine has to be awaited.
         """
+        self._rejections.clear()
+        if self._storage_async:
+            return self.__reset_async()
         try:
             self._storage.reset()
             self.logger.info("Storage has been reset and all limits cleared")
         except NotImplementedError:
             self.logger.warning("This storage type does not support being reset")
+
+    async def __reset_async(self):
+        try:
+            await self._storage.reset()
+            self.logger.info("Storage has been reset and all limits cleared")
+        except NotImplementedError:
+            self.logger.warning("This storage type does not support being reset")
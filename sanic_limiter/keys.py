@@ -0,0 +1,121 @@
+"""
+compact storage keys, see :class:`CompactKeys`
+"""
+import base64
+import hashlib
+
+import six
+
+from .strategies import LimiterWrapper
+
+
+def _digest(value, size):
+    digest = hashlib.md5(six.text_type(value).encode("utf-8", "surrogatepass")).digest()
+    return base64.urlsafe_b64encode(digest[:size]).decode("ascii")
+
+
+class CompactKeys(object):
+    """
+    encodes storage keys into a fixed width form of the namespace, an id of
+    the scope of the limit and a digest of the key of the client, e.g.
+    ``LIMITER/cXr0bP2k1Jq0dMIGwXa9E2CQyNfk`` instead of
+    ``LIMITER/2001:db8::1//api/v1/users/42/orders:GET/10/1/minute``.
+
+    scope ids are derived from the scope, so every worker and host assigns
+    the same ids, and interned so they are only computed once per scope.
+    keys whose readable form is not longer than the compact one are kept
+    as they are; their readable form contains a ``/`` after the namespace
+    which the url safe base64 of compact keys does not, so the two can't
+    collide. scope ids have 72 and key digests 96 bits.
+    """
+    NAMESPACE = "LIMITER"
+    SCOPE_SIZE = 9
+    KEY_SIZE = 12
+    SCOPE_CACHE_SIZE = 10000
+
+    def __init__(self):
+        self._scopes = {}
+        self.length = len(self.NAMESPACE) + 1 + (self.SCOPE_SIZE + self.KEY_SIZE) * 4 // 3
+
+    def scope_id(self, scope):
+        """
+        :param tuple scope: strings identifying the limit
+        :return: the interned id of ``scope``
+        """
+        try:
+            return self._scopes[scope]
+        except KeyError:
+            if len(self._scopes) >= self.SCOPE_CACHE_SIZE:
+                self._scopes.clear()
+            scope_id = self._scopes[scope] = _digest("\x00".join(scope), self.SCOPE_SIZE)
+            return scope_id
+
+    def encode(self, readable, key, *scope):
+        """
+        :param str readable: the storage key in its readable form
+        :param key: the key of the client returned by the key function
+        :param scope: strings identifying the limit
+        :return: the compact storage key, or ``readable`` if that is shorter
+        """
+        if len(readable) <= self.length:
+            return readable
+        return "%s/%s%s" % (
+            self.NAMESPACE, self.scope_id(scope), _digest(key, self.KEY_SIZE)
+        )
+
+
+class CompactRateLimitItem(object):
+    """
+    a :class:`limits.RateLimitItem` whose keys are encoded by
+    :class:`CompactKeys`
+    """
+    __slots__ = ["item", "amount", "keys", "suffix"]
+
+    def __init__(self, item, keys):
+        self.item = item
+        self.amount = item.amount
+        self.keys = keys
+        # the identifiers of the limit appended by its readable key
+        self.suffix = tuple(item.key_for().split("/")[1:])
+
+    def get_expiry(self):
+        return self.item.get_expiry()
+
+    def key_for(self, *identifiers):
+        return self.keys.encode(
+            self.item.key_for(*identifiers), identifiers[0],
+            *(tuple(str(i) for i in identifiers[1:]) + self.suffix)
+        )
+
+    def __getattr__(self, name):
+        return getattr(self.item, name)
+
+    def __str__(self):
+        return str(self.item)
+
+
+class CompactKeyLimiter(LimiterWrapper):
+    """
+    wraps a rate limiter, encoding the keys of all limits it is called with
+    by :class:`CompactKeys`.
+    """
+    ITEM_CACHE_SIZE = 1000
+
+    def __init__(self, limiter, keys):
+        super(CompactKeyLimiter, self).__init__(limiter)
+        self.keys = keys
+        self._items = {}
+
+    def item(self, item):
+        """
+        :return: the :class:`CompactRateLimitItem` of ``item``
+        """
+        # items scaled by the adaptive limits keep the key of their limit
+        cache_key = (item.amount, item.key_for())
+        try:
+            return self._items[cache_key]
+        except KeyError:
+            if len(self._items) >= self.ITEM_CACHE_SIZE:
+                self._items.clear()
+            compact = self._items[cache_key] = CompactRateLimitItem(item, self.keys)
+            return compact
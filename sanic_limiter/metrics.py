@@ -0,0 +1,191 @@
+"""
+metrics hooks of the extension
+"""
+from bisect import bisect_left
+
+
+class Metrics(object):
+    """
+    interface of the metrics collected by :class:`sanic_limiter.Limiter`.
+
+    this base class ignores everything. the middleware only measures
+    latencies and calls the hooks when ``enabled`` is True, so leaving the
+    default in place costs nothing on the hot path.
+    """
+    enabled = False
+
+    def hit(self, scope):
+        """
+        a limit with ``scope`` was hit and not exceeded
+        """
+
+    def rejected(self, scope):
+        """
+        a request was rejected by a limit with ``scope``
+        """
+
+    def delayed(self, scope, seconds):
+        """
+        a request exceeding a limit with ``scope`` was admitted after waiting
+        ``seconds`` for it
+        """
+
+    def exempt(self, name):
+        """
+        a request for the view ``name`` was not limited because of an
+        exemption or a request filter
+        """
+
+    def storage_error(self):
+        """
+        calling the storage raised an exception
+        """
+
+    def breaker_transition(self, state):
+        """
+        the storage circuit breaker changed to ``state``
+        """
+
+    def observe_key(self, seconds):
+        """
+        computing a key with the key function took ``seconds``
+        """
+
+    def observe_storage(self, seconds):
+        """
+        a storage call took ``seconds``
+        """
+
+
+class Histogram(object):
+    __slots__ = ["buckets", "counts", "sum", "count"]
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(**labels):
+    return "{%s}" % ",".join(
+        '%s="%s"' % (
+            name,
+            str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        )
+        for name, value in sorted(labels.items())
+    ) if labels else ""
+
+
+class PrometheusMetrics(Metrics):
+    """
+    keeps counters and latency histograms in process and renders them in the
+    prometheus text exposition format. counters are labelled with the limit
+    scope, which is the request path for limits that are neither shared nor
+    scoped by route, so mind the number of series for parameterized routes.
+
+    :param str namespace: prefix of the metric names
+    :param tuple buckets: upper bounds in seconds of the latency histograms
+    :param tuple delay_buckets: upper bounds in seconds of the histogram of
+     the time delayed requests waited
+    """
+    enabled = True
+    BUCKETS = (
+        0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+        0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0
+    )
+    DELAY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, namespace="sanic_limiter", buckets=BUCKETS,
+                 delay_buckets=DELAY_BUCKETS):
+        self.namespace = namespace
+        self.buckets = tuple(sorted(buckets))
+        self.hits = {}
+        self.rejections = {}
+        self.exemptions = {}
+        self.delays = {}
+        self.storage_errors = 0
+        self.breaker_transitions = {}
+        self.key_latency = Histogram(self.buckets)
+        self.storage_latency = Histogram(self.buckets)
+        self.delay_latency = Histogram(tuple(sorted(delay_buckets)))
+
+    def hit(self, scope):
+        self.hits[scope] = self.hits.get(scope, 0) + 1
+
+    def rejected(self, scope):
+        self.rejections[scope] = self.rejections.get(scope, 0) + 1
+
+    def delayed(self, scope, seconds):
+        self.delays[scope] = self.delays.get(scope, 0) + 1
+        self.delay_latency.observe(seconds)
+
+    def exempt(self, name):
+        self.exemptions[name] = self.exemptions.get(name, 0) + 1
+
+    def storage_error(self):
+        self.storage_errors += 1
+
+    def breaker_transition(self, state):
+        self.breaker_transitions[state] = self.breaker_transitions.get(state, 0) + 1
+
+    def observe_key(self, seconds):
+        self.key_latency.observe(seconds)
+
+    def observe_storage(self, seconds):
+        self.storage_latency.observe(seconds)
+
+    def __counter(self, lines, name, help_text, values, label=None):
+        name = "%s_%s" % (self.namespace, name)
+        lines.append("# HELP %s %s" % (name, help_text))
+        lines.append("# TYPE %s counter" % name)
+        if label is None:
+            lines.append("%s %s" % (name, values))
+            return
+        for value, count in sorted(values.items()):
+            lines.append("%s%s %s" % (name, _labels(**{label: value}), count))
+
+    def __histogram(self, lines, name, help_text, histogram):
+        name = "%s_%s" % (self.namespace, name)
+        lines.append("# HELP %s %s" % (name, help_text))
+        lines.append("# TYPE %s histogram" % name)
+        cumulative = 0
+        for bucket, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append("%s_bucket%s %s" % (name, _labels(le=repr(bucket)), cumulative))
+        lines.append("%s_bucket%s %s" % (name, _labels(le="+Inf"), histogram.count))
+        lines.append("%s_sum %s" % (name, repr(histogram.sum)))
+        lines.append("%s_count %s" % (name, histogram.count))
+
+    def render(self):
+        """
+        :return: all metrics in the prometheus text exposition format
+        """
+        lines = []
+        self.__counter(lines, "hits_total", "Limit hits which were allowed.",
+                       self.hits, "scope")
+        self.__counter(lines, "rejections_total", "Requests rejected by a limit.",
+                       self.rejections, "scope")
+        self.__counter(lines, "delays_total", "Requests admitted after waiting for a limit.",
+                       self.delays, "scope")
+        self.__counter(lines, "exempt_total", "Requests skipped by an exemption or filter.",
+                       self.exemptions, "view")
+        self.__counter(lines, "storage_errors_total", "Exceptions raised by the storage.",
+                       self.storage_errors)
+        self.__counter(lines, "breaker_transitions_total",
+                       "State changes of the storage circuit breaker.",
+                       self.breaker_transitions, "state")
+        self.__histogram(lines, "key_seconds", "Time spent in key functions.",
+                         self.key_latency)
+        self.__histogram(lines, "storage_seconds", "Time spent in storage calls.",
+                         self.storage_latency)
+        self.__histogram(lines, "delay_seconds", "Time delayed requests waited for a limit.",
+                         self.delay_latency)
+        return "\n".join(lines) + "\n"
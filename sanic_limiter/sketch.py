@@ -0,0 +1,156 @@
+"""
+constant memory summaries of the keys hitting the limits
+"""
+from array import array
+import heapq
+import itertools
+import sys
+import time
+
+
+class CountMinSketch(object):
+    """
+    estimates the number of occurrences of items in a stream with ``depth``
+    rows of ``width`` counters. an estimate is never below the true count
+    and exceeds it by at most ``2 / width`` of all occurrences with a
+    probability of ``1 - 2 ** -depth``.
+
+    :param int width: the number of counters per row, rounded up to a power
+     of two
+    :param int depth: the number of rows
+    """
+
+    def __init__(self, width=2048, depth=4):
+        self.bits = max(1, (width - 1).bit_length())
+        self.width = 1 << self.bits
+        self.depth = depth
+        # the rows of the sketch one after another
+        self.counters = array("L", [0]) * (self.width * depth)
+
+    def add(self, item, count=1):
+        """
+        counts ``count`` occurrences of ``item``, only raising the counters
+        which are below the new estimate (conservative update).
+
+        :return: the estimated number of occurrences of ``item``
+        """
+        counters = self.counters
+        indexes = self.__indexes(item)
+        estimate = min([counters[index] for index in indexes]) + count
+        for index in indexes:
+            if counters[index] < estimate:
+                counters[index] = estimate
+        return estimate
+
+    def estimate(self, item):
+        """
+        :return: the estimated number of occurrences of ``item``
+        """
+        counters = self.counters
+        return min([counters[index] for index in self.__indexes(item)])
+
+    def halve(self):
+        """
+        halves all counters, so old occurrences weigh less than recent ones
+        """
+        counters = self.counters
+        for index, value in enumerate(counters):
+            if value:
+                counters[index] = value >> 1
+
+    def __indexes(self, item):
+        # every row takes the next ``bits`` bits of the hash of the item
+        bits = self.bits
+        mask = self.width - 1
+        value = hash(item)
+        remaining = sys.hash_info.width
+        indexes = []
+        for row in range(self.depth):
+            if remaining < bits:
+                value = hash((value, row))
+                remaining = sys.hash_info.width
+            indexes.append((row << bits) | (value & mask))
+            value >>= bits
+            remaining -= bits
+        return indexes
+
+
+class HeavyHitters(object):
+    """
+    tracks the ``size`` most frequent items of a stream with a
+    :class:`CountMinSketch`: an item whose estimate exceeds the smallest
+    estimate of the tracked items replaces that item. counts are halved
+    every ``decay_interval`` seconds so the summary follows the recent
+    traffic.
+
+    :param int size: the number of top items tracked
+    :param float decay_interval: seconds between halving all counts
+    :param int width: the number of counters per row of the sketch
+    :param int depth: the number of rows of the sketch
+    """
+
+    def __init__(self, size=100, decay_interval=60, width=2048, depth=4):
+        self.size = size
+        self.decay_interval = decay_interval
+        self.sketch = CountMinSketch(width, depth)
+        self.top = {}
+        # min heap of (estimate, sequence, item) of the tracked items, the
+        # estimates of items counted since they were pushed are outdated
+        self._heap = []
+        self._sequence = itertools.count()
+        self._decay_at = time.time() + decay_interval
+
+    def add(self, item, count=1):
+        """
+        :return: the estimated number of recent occurrences of ``item``
+        """
+        if self.decay_interval and time.time() >= self._decay_at:
+            self.decay()
+        estimate = self.sketch.add(item, count)
+        top = self.top
+        if item in top:
+            top[item] = estimate
+            return estimate
+        heap = self._heap
+        if len(top) < self.size:
+            top[item] = estimate
+            heapq.heappush(heap, (estimate, next(self._sequence), item))
+            return estimate
+        if estimate <= heap[0][0]:
+            return estimate
+        while True:
+            floor, _, smallest = heap[0]
+            current = top[smallest]
+            if current == floor:
+                break
+            heapq.heapreplace(heap, (current, next(self._sequence), smallest))
+        if estimate > floor:
+            heapq.heapreplace(heap, (estimate, next(self._sequence), item))
+            del top[smallest]
+            top[item] = estimate
+        return estimate
+
+    def decay(self):
+        """
+        halves all counts
+        """
+        self.sketch.halve()
+        for item, estimate in self.top.items():
+            self.top[item] = estimate >> 1
+        self._heap = [
+            (estimate, next(self._sequence), item)
+            for item, estimate in self.top.items()
+        ]
+        heapq.heapify(self._heap)
+        self._decay_at = time.time() + self.decay_interval
+
+    def most_common(self, n=None):
+        """
+        :return: list of the ``n`` (default all) tracked items and their
+         estimated number of recent occurrences, most frequent first
+        """
+        items = sorted(self.top.items(), key=lambda item: item[1], reverse=True)
+        return items[:n] if n is not None else items
+
+    def __contains__(self, item):
+        return item in self.top
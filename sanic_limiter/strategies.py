@@ -0,0 +1,454 @@
+"""
+asyncio rate limiting strategies, counterparts of :mod:`limits.strategies`
+operating on :class:`sanic_limiter.storage.AsyncStorage` backends.
+"""
+from abc import ABCMeta, abstractmethod
+import time
+import weakref
+
+import six
+
+
+@six.add_metaclass(ABCMeta)
+class AsyncRateLimiter(object):
+    def __init__(self, storage):
+        self.storage = weakref.ref(storage)
+
+    @classmethod
+    def supports(cls, storage):
+        """
+        :param storage: an asyncio storage or its class
+        :return: True if the strategy can rate limit with ``storage``
+        """
+        return True
+
+    @abstractmethod
+    async def hit(self, item, *identifiers, cost=1):
+        """
+        creates a hit on the rate limit and returns True if successful.
+
+        :param item: a :class:`RateLimitItem` instance
+        :param identifiers: variable list of strings to uniquely identify the
+         limit
+        :param int cost: the number of hits, consumed all at once or, when
+         they exceed the limit, not at all
+        :return: True/False
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def test(self, item, *identifiers):
+        """
+        checks  the rate limit and returns True if it is not
+        currently exceeded.
+
+        :param item: a :class:`RateLimitItem` instance
+        :param identifiers: variable list of strings to uniquely identify the
+         limit
+        :return: True/False
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_window_stats(self, item, *identifiers):
+        """
+        returns the number of requests remaining and reset of this limit.
+
+        :param item: a :class:`RateLimitItem` instance
+        :param identifiers: variable list of strings to uniquely identify the
+         limit
+        :return: tuple (reset time (int), remaining (int))
+        """
+        raise NotImplementedError
+
+    async def hit_with_stats(self, item, *identifiers, cost=1):
+        """
+        creates a hit on the rate limit and returns the window stats after
+        the hit. storages able to do so answer both with a single call,
+        others are asked for the window stats separately.
+
+        :param item: a :class:`RateLimitItem` instance
+        :param identifiers: variable list of strings to uniquely identify the
+         limit
+        :param int cost: the number of hits
+        :return: tuple (hit successful (bool), reset time (int), remaining (int))
+        """
+        allowed = await self.hit(item, *identifiers, cost=cost)
+        reset, remaining = await self.get_window_stats(item, *identifiers)
+        return allowed, reset, remaining
+
+    async def hit_many(self, hits, costs=None):
+        """
+        creates a hit on several rate limits. storages able to do so check
+        and hit all limits atomically in a single call, so either every limit
+        is hit or, when one is exceeded, none of them is. other storages
+        hit the limits one after another until one is exceeded.
+
+        :param hits: list of tuples of a :class:`RateLimitItem` instance
+         and a tuple of identifiers for the limit
+        :param list costs: the number of hits on each limit, default 1
+        :return: index of the first exceeded limit in ``hits`` or None
+        """
+        for index, (item, identifiers) in enumerate(hits):
+            cost = costs[index] if costs else 1
+            if not await self.hit(item, *identifiers, cost=cost):
+                return index
+        return None
+
+    async def hit_many_with_stats(self, hits, costs=None):
+        """
+        creates a hit on several rate limits like :meth:`hit_many` and
+        returns the window stats after the hits. storages able to do so
+        answer both with a single call, others are asked for the window
+        stats separately.
+
+        :param hits: list of tuples of a :class:`RateLimitItem` instance
+         and a tuple of identifiers for the limit
+        :param list costs: the number of hits on each limit, default 1
+        :return: tuple of the index of the first exceeded limit in ``hits``
+         or None, and a list of tuples (reset time (int), remaining (int))
+         of every limit. when a limit was exceeded only its window is
+         guaranteed to be read, the others may be None.
+        """
+        index = await self.hit_many(hits, costs)
+        stats = [None] * len(hits)
+        for position in range(len(hits)) if index is None else [index]:
+            item, identifiers = hits[position]
+            stats[position] = await self.get_window_stats(item, *identifiers)
+        return index, stats
+
+    async def clear(self, item, *identifiers):
+        return await self.storage().clear(item.key_for(*identifiers))
+
+
+class AsyncMovingWindowRateLimiter(AsyncRateLimiter):
+    """
+    Reference: :ref:`moving-window`
+    """
+
+    def __init__(self, storage):
+        if not self.supports(storage):
+            raise NotImplementedError(
+                "MovingWindowRateLimiting is not implemented for storage of type %s"
+                % storage.__class__
+            )
+        super(AsyncMovingWindowRateLimiter, self).__init__(storage)
+
+    @classmethod
+    def supports(cls, storage):
+        return (
+            hasattr(storage, "acquire_entry")
+            or hasattr(storage, "get_moving_window")
+        )
+
+    async def hit(self, item, *identifiers, cost=1):
+        return await self.storage().acquire_entry(
+            item.key_for(*identifiers), item.amount, item.get_expiry(), amount=cost
+        )
+
+    async def hit_with_stats(self, item, *identifiers, cost=1):
+        storage = self.storage()
+        if not hasattr(storage, "acquire_entry_with_window"):
+            return await super(AsyncMovingWindowRateLimiter, self).hit_with_stats(
+                item, *identifiers, cost=cost
+            )
+        acquired, window_start, window_items = await storage.acquire_entry_with_window(
+            item.key_for(*identifiers), item.amount, item.get_expiry(), cost
+        )
+        return (
+            acquired, window_start + item.get_expiry(),
+            max(0, item.amount - window_items)
+        )
+
+    async def hit_many(self, hits, costs=None):
+        storage = self.storage()
+        if not hasattr(storage, "acquire_entries"):
+            return await super(AsyncMovingWindowRateLimiter, self).hit_many(hits, costs)
+        return await storage.acquire_entries([
+            (item.key_for(*identifiers), item.amount, item.get_expiry())
+            for item, identifiers in hits
+        ], costs)
+
+    async def hit_many_with_stats(self, hits, costs=None):
+        storage = self.storage()
+        if not hasattr(storage, "acquire_entries_with_windows"):
+            return await super(
+                AsyncMovingWindowRateLimiter, self
+            ).hit_many_with_stats(hits, costs)
+        index, windows = await storage.acquire_entries_with_windows([
+            (item.key_for(*identifiers), item.amount, item.get_expiry())
+            for item, identifiers in hits
+        ], costs)
+        return index, [
+            (window_start + item.get_expiry(), max(0, item.amount - window_items))
+            for (item, _), (window_start, window_items) in zip(hits, windows)
+        ]
+
+    async def test(self, item, *identifiers):
+        window = await self.storage().get_moving_window(
+            item.key_for(*identifiers), item.amount, item.get_expiry()
+        )
+        return window[1] < item.amount
+
+    async def get_window_stats(self, item, *identifiers):
+        window_start, window_items = await self.storage().get_moving_window(
+            item.key_for(*identifiers), item.amount, item.get_expiry()
+        )
+        reset = window_start + item.get_expiry()
+        return (reset, item.amount - window_items)
+
+
+class AsyncFixedWindowRateLimiter(AsyncRateLimiter):
+    """
+    Reference: :ref:`fixed-window`
+    """
+    elastic_expiry = False
+
+    async def hit(self, item, *identifiers, cost=1):
+        storage = self.storage()
+        key = item.key_for(*identifiers)
+        if cost != 1 and hasattr(storage, "incr_many"):
+            # a hit exceeding the limit does not consume its cost
+            return await storage.incr_many(
+                [(key, item.get_expiry(), item.amount)], self.elastic_expiry, [cost]
+            ) is None
+        count = await storage.incr(key, item.get_expiry(), self.elastic_expiry, cost)
+        return count <= item.amount
+
+    async def hit_with_stats(self, item, *identifiers, cost=1):
+        storage = self.storage()
+        if cost != 1 and hasattr(storage, "incr_many_with_expiry"):
+            # a hit exceeding the limit does not consume its cost
+            index, windows = await storage.incr_many_with_expiry(
+                [(item.key_for(*identifiers), item.get_expiry(), item.amount)],
+                self.elastic_expiry, [cost]
+            )
+            count, expiry = windows[0]
+            return index is None, int(expiry), max(0, item.amount - count)
+        if cost != 1 or not hasattr(storage, "incr_with_expiry"):
+            return await super(AsyncFixedWindowRateLimiter, self).hit_with_stats(
+                item, *identifiers, cost=cost
+            )
+        count, expiry = await storage.incr_with_expiry(
+            item.key_for(*identifiers), item.get_expiry(), self.elastic_expiry
+        )
+        return count <= item.amount, int(expiry), max(0, item.amount - count)
+
+    async def hit_many(self, hits, costs=None):
+        storage = self.storage()
+        if not hasattr(storage, "incr_many"):
+            return await super(AsyncFixedWindowRateLimiter, self).hit_many(hits, costs)
+        return await storage.incr_many([
+            (item.key_for(*identifiers), item.get_expiry(), item.amount)
+            for item, identifiers in hits
+        ], self.elastic_expiry, costs)
+
+    async def hit_many_with_stats(self, hits, costs=None):
+        storage = self.storage()
+        if not hasattr(storage, "incr_many_with_expiry"):
+            return await super(
+                AsyncFixedWindowRateLimiter, self
+            ).hit_many_with_stats(hits, costs)
+        index, windows = await storage.incr_many_with_expiry([
+            (item.key_for(*identifiers), item.get_expiry(), item.amount)
+            for item, identifiers in hits
+        ], self.elastic_expiry, costs)
+        return index, [
+            (int(expiry), max(0, item.amount - count))
+            for (item, _), (count, expiry) in zip(hits, windows)
+        ]
+
+    async def test(self, item, *identifiers):
+        return await self.storage().get(item.key_for(*identifiers)) < item.amount
+
+    async def get_window_stats(self, item, *identifiers):
+        key = item.key_for(*identifiers)
+        remaining = max(0, item.amount - await self.storage().get(key))
+        reset = await self.storage().get_expiry(key)
+        return (reset, remaining)
+
+
+class AsyncFixedWindowElasticExpiryRateLimiter(AsyncFixedWindowRateLimiter):
+    """
+    Reference: :ref:`fixed-window-elastic`
+    """
+    elastic_expiry = True
+
+
+class AsyncGCRARateLimiter(AsyncRateLimiter):
+    """
+    generic cell rate algorithm: a limit of ``amount`` per ``expiry`` seconds
+    lets a hit through every ``expiry / amount`` seconds with bursts of up to
+    ``amount`` hits. only the theoretical arrival time (tat) of the next hit
+    is stored per key and every hit is a single storage call.
+
+    the reset time is when the next hit becomes available.
+    """
+
+    def __init__(self, storage):
+        if not self.supports(storage):
+            raise NotImplementedError(
+                "GCRARateLimiting is not implemented for storage of type %s"
+                % storage.__class__
+            )
+        super(AsyncGCRARateLimiter, self).__init__(storage)
+
+    @classmethod
+    def supports(cls, storage):
+        return hasattr(storage, "gcra_acquire")
+
+    async def __acquire(self, item, identifiers, amount):
+        expiry = item.get_expiry()
+        return await self.storage().gcra_acquire(
+            item.key_for(*identifiers), expiry / float(item.amount), expiry, amount
+        )
+
+    @staticmethod
+    def __stats(item, tat):
+        expiry = item.get_expiry()
+        emission_interval = expiry / float(item.amount)
+        now = time.time()
+        # the epsilon absorbs float error of whole multiples of the interval
+        remaining = int((expiry - max(0.0, tat - now)) / emission_interval + 1e-9)
+        remaining = max(0, min(item.amount, remaining))
+        if remaining == item.amount:
+            return int(now), remaining
+        return int(tat - expiry + (remaining + 1) * emission_interval), remaining
+
+    async def hit(self, item, *identifiers, cost=1):
+        return (await self.__acquire(item, identifiers, cost))[0]
+
+    async def hit_with_stats(self, item, *identifiers, cost=1):
+        acquired, tat = await self.__acquire(item, identifiers, cost)
+        return (acquired,) + self.__stats(item, tat)
+
+    async def test(self, item, *identifiers):
+        return (await self.get_window_stats(item, *identifiers))[1] > 0
+
+    async def get_window_stats(self, item, *identifiers):
+        _, tat = await self.__acquire(item, identifiers, 0)
+        return self.__stats(item, tat)
+
+
+class AsyncSlidingWindowCounterRateLimiter(AsyncRateLimiter):
+    """
+    approximates a moving window with the counters of the current and the
+    previous fixed window, weighting the previous counter by how much of it
+    the sliding window still covers. two counters are stored per key and
+    every hit is a single storage call.
+
+    the reset time is when the next hit becomes available, at the latest the
+    end of the current fixed window.
+    """
+
+    def __init__(self, storage):
+        if not self.supports(storage):
+            raise NotImplementedError(
+                "SlidingWindowCounterRateLimiting is not implemented for storage of type %s"
+                % storage.__class__
+            )
+        super(AsyncSlidingWindowCounterRateLimiter, self).__init__(storage)
+
+    @classmethod
+    def supports(cls, storage):
+        return hasattr(storage, "sliding_window_acquire")
+
+    @staticmethod
+    def __windows(item, identifiers):
+        """
+        :return: tuple of the previous and current window keys, the weight of
+         the previous window and the end of the current window
+        """
+        key = item.key_for(*identifiers)
+        expiry = item.get_expiry()
+        now = time.time()
+        window = int(now // expiry)
+        weight = 1 - (now - window * expiry) / float(expiry)
+        return (
+            "%s/%d" % (key, window - 1), "%s/%d" % (key, window),
+            weight, (window + 1) * expiry
+        )
+
+    async def __acquire(self, item, identifiers, amount):
+        previous_key, current_key, weight, reset = self.__windows(item, identifiers)
+        expiry = item.get_expiry()
+        acquired, previous, current = await self.storage().sliding_window_acquire(
+            previous_key, current_key, item.amount, expiry, weight, amount
+        )
+        remaining = max(0, int(item.amount - previous * weight - current))
+        if not remaining and previous and current < item.amount:
+            # the weight of the previous window leaving room for one more hit
+            weight = (item.amount - current - 1) / float(previous)
+            reset = min(reset, int(reset - weight * expiry))
+        return acquired, reset, remaining
+
+    async def hit(self, item, *identifiers, cost=1):
+        return (await self.__acquire(item, identifiers, cost))[0]
+
+    async def hit_with_stats(self, item, *identifiers, cost=1):
+        return await self.__acquire(item, identifiers, cost)
+
+    async def test(self, item, *identifiers):
+        return (await self.get_window_stats(item, *identifiers))[1] > 0
+
+    async def get_window_stats(self, item, *identifiers):
+        _, reset, remaining = await self.__acquire(item, identifiers, 0)
+        return reset, remaining
+
+    async def clear(self, item, *identifiers):
+        previous_key, current_key, _, _ = self.__windows(item, identifiers)
+        await self.storage().clear(previous_key)
+        await self.storage().clear(current_key)
+
+
+class LimiterWrapper(object):
+    """
+    wraps a rate limiter of :mod:`limits.strategies` or of this module,
+    passing the rate limit items it is called with through :meth:`item`.
+    the results of the wrapped limiter are returned as they are, so they
+    have to be awaited if it is an asyncio rate limiter.
+    """
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+
+    def item(self, item):
+        """
+        :return: the rate limit item to pass to the wrapped limiter instead
+         of ``item``
+        """
+        return item
+
+    def hit(self, item, *identifiers, **kwargs):
+        return self.limiter.hit(self.item(item), *identifiers, **kwargs)
+
+    def hit_with_stats(self, item, *identifiers, **kwargs):
+        return self.limiter.hit_with_stats(self.item(item), *identifiers, **kwargs)
+
+    def hit_many(self, hits, costs=None):
+        return self.limiter.hit_many(
+            [(self.item(item), identifiers) for item, identifiers in hits], costs
+        )
+
+    def hit_many_with_stats(self, hits, costs=None):
+        return self.limiter.hit_many_with_stats(
+            [(self.item(item), identifiers) for item, identifiers in hits], costs
+        )
+
+    def test(self, item, *identifiers):
+        return self.limiter.test(self.item(item), *identifiers)
+
+    def get_window_stats(self, item, *identifiers):
+        return self.limiter.get_window_stats(self.item(item), *identifiers)
+
+    def clear(self, item, *identifiers):
+        return self.limiter.clear(self.item(item), *identifiers)
+
+
+STRATEGIES = {
+    "fixed-window": AsyncFixedWindowRateLimiter,
+    "fixed-window-elastic-expiry": AsyncFixedWindowElasticExpiryRateLimiter,
+    "moving-window": AsyncMovingWindowRateLimiter,
+    "gcra": AsyncGCRARateLimiter,
+    "sliding-window-counter": AsyncSlidingWindowCounterRateLimiter
+}
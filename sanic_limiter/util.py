@@ -1,6 +1,9 @@
 """
 
 """
+import ipaddress
+
+import six
 
 
 def get_remote_address(request):
@@ -14,3 +17,135 @@ def get_remote_address(request):
         return request.remote_addr
     else:
         return request.ip
+
+
+def parse_address(address):
+    """
+    :param address: an ip address string or :mod:`ipaddress` address
+    :return: the :mod:`ipaddress` address, the ipv4 address of ipv4 mapped
+     ipv6 addresses, or None if ``address`` is not an ip address
+    """
+    if not isinstance(address, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+        try:
+            address = ipaddress.ip_address(six.text_type(address))
+        except ValueError:
+            return None
+    if address.version == 6 and address.ipv4_mapped is not None:
+        return address.ipv4_mapped
+    return address
+
+
+class AddressSet(object):
+    """
+    a set of ip networks compiled into a binary prefix trie per ip version,
+    so looking up an address takes at most as many steps as the prefix
+    length of the longest network, however many networks the set holds.
+
+    :param networks: ip network strings (e.g. ``10.0.0.0/8``, ``2001:db8::/32``)
+     or :mod:`ipaddress` networks
+    """
+    __slots__ = ["_tries", "networks"]
+
+    def __init__(self, networks=()):
+        # a node is a list of its two children, True marks a covered subtree
+        self._tries = {4: None, 6: None}
+        self.networks = []
+        for network in networks:
+            self.add(network)
+
+    def add(self, network):
+        """
+        :param network: ip network string or :mod:`ipaddress` network
+        :raise ValueError: if ``network`` is not an ip network
+        """
+        network = ipaddress.ip_network(six.text_type(network), strict=False)
+        self.networks.append(network)
+        value = int(network.network_address)
+        bits = network.max_prefixlen
+        parent, index = self._tries, network.version
+        for depth in range(network.prefixlen):
+            node = parent[index]
+            if node is True:
+                # already covered by a shorter network
+                return
+            if node is None:
+                node = parent[index] = [None, None]
+            parent, index = node, (value >> (bits - 1 - depth)) & 1
+        parent[index] = True
+
+    def __contains__(self, address):
+        address = parse_address(address)
+        if address is None:
+            return False
+        node = self._tries[address.version]
+        value = int(address)
+        shift = address.max_prefixlen
+        while node is not None:
+            if node is True:
+                return True
+            shift -= 1
+            node = node[(value >> shift) & 1]
+        return False
+
+    def __len__(self):
+        return len(self.networks)
+
+
+class RemoteAddress(object):
+    """
+    key function aggregating client addresses to networks, so a client
+    rotating through the addresses of its network (e.g. the /64 of an ipv6
+    client) is limited as one. the address is the one of the peer unless
+    the peer is a trusted proxy, in which case the last address of the
+    forwarding header which is not a trusted proxy is the client.
+
+    :param int ipv4_prefix: the number of bits of ipv4 addresses kept in the
+     key. default 32, one key per address
+    :param int ipv6_prefix: the number of bits of ipv6 addresses kept in the
+     key. default 64
+    :param trusted_proxies: ip networks (or an :class:`AddressSet`) of the
+     proxies whose forwarding header is honoured. default none
+    :param str header: the header the proxies append the client address to.
+     default ``X-Forwarded-For``
+    """
+
+    def __init__(self, ipv4_prefix=32, ipv6_prefix=64, trusted_proxies=(),
+                 header="X-Forwarded-For"):
+        self.prefixes = {4: ipv4_prefix, 6: ipv6_prefix}
+        self.trusted_proxies = (
+            trusted_proxies if isinstance(trusted_proxies, AddressSet)
+            else AddressSet(trusted_proxies)
+        )
+        self.header = header
+
+    def client_address(self, request):
+        """
+        :param: request: request object of sanic
+        :return: the :mod:`ipaddress` address of the client or None if it is
+         unknown
+        """
+        peer = request.ip
+        if isinstance(peer, tuple):
+            # the peername of old sanic releases
+            peer = peer[0]
+        address = parse_address(peer)
+        if address is None or not self.trusted_proxies or address not in self.trusted_proxies:
+            return address
+        for hop in reversed(request.headers.get(self.header, "").split(",")):
+            hop = parse_address(hop.strip())
+            if hop is None:
+                break
+            address = hop
+            if hop not in self.trusted_proxies:
+                break
+        return address
+
+    def __call__(self, request):
+        address = self.client_address(request)
+        if address is None:
+            return get_remote_address(request)
+        prefix = self.prefixes[address.version]
+        if prefix >= address.max_prefixlen:
+            return str(address)
+        mask = ((1 << prefix) - 1) << (address.max_prefixlen - prefix)
+        return "%s/%d" % (ipaddress.ip_address(int(address) & mask), prefix)
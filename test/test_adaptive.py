@@ -0,0 +1,84 @@
+import asyncio
+import time
+import unittest
+
+from limits import RateLimitItemPerMinute
+
+from sanic_limiter.adaptive import AdaptiveLimiter, LoadMonitor
+from sanic_limiter.keys import CompactKeyLimiter, CompactKeys
+from sanic_limiter.storage import AsyncMemoryStorage
+from sanic_limiter.strategies import AsyncFixedWindowRateLimiter
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class LoadMonitorTest(unittest.TestCase):
+
+    def test_update(self):
+        monitor = LoadMonitor(max_lag=0.05, max_in_flight=10, min_factor=0.2)
+        monitor.lag = 0.1
+        monitor.update()
+        self.assertAlmostEqual(0.7, monitor.factor)
+        for _ in range(10):
+            monitor.update()
+        self.assertEqual(0.2, monitor.factor)
+        monitor.lag = 0.0
+        monitor.in_flight = 11
+        monitor.update()
+        self.assertEqual(0.2, monitor.factor)
+        monitor.in_flight = 10
+        monitor.update()
+        self.assertAlmostEqual(0.25, monitor.factor)
+        for _ in range(20):
+            monitor.update()
+        self.assertEqual(1.0, monitor.factor)
+
+    def test_lag(self):
+        monitor = LoadMonitor(max_lag=0.05, interval=0.01)
+
+        async def block():
+            await asyncio.sleep(0.005)
+            # blocks the event loop
+            time.sleep(0.1)
+
+        async def sample():
+            task = asyncio.ensure_future(monitor.run())
+            await block()
+            await asyncio.sleep(0.02)
+            task.cancel()
+
+        run(sample())
+        self.assertLess(monitor.factor, 1.0)
+
+
+class AdaptiveLimiterTest(unittest.TestCase):
+
+    def test_scaled_limits(self):
+        monitor = LoadMonitor()
+        storage = AsyncMemoryStorage()
+        limiter = AdaptiveLimiter(
+            CompactKeyLimiter(AsyncFixedWindowRateLimiter(storage), CompactKeys()),
+            monitor
+        )
+        limit = RateLimitItemPerMinute(4)
+        scope = "/a/scope/long/enough/for/a/compact/key"
+        monitor.factor = 0.5
+        self.assertTrue(run(limiter.hit(limit, "k", scope)))
+        self.assertTrue(run(limiter.hit(limit, "k", scope)))
+        self.assertFalse(run(limiter.hit(limit, "k", scope)))
+        self.assertEqual(0, run(limiter.get_window_stats(limit, "k", scope))[1])
+        # the counter, which counted the rejected hit as well, is kept when
+        # the load goes down
+        monitor.factor = 1.0
+        self.assertTrue(run(limiter.hit(limit, "k", scope)))
+        self.assertFalse(run(limiter.hit(limit, "k", scope)))
+        self.assertEqual(1, len(storage.storage))
+        monitor.factor = 0.1
+        # at least one hit is admitted
+        self.assertEqual(1, limiter.item(limit).amount)
@@ -0,0 +1,34 @@
+import importlib.util
+import json
+import os
+import tempfile
+import unittest
+
+BENCHMARK = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks", "bench_middleware.py"
+)
+
+
+def load_benchmark():
+    spec = importlib.util.spec_from_file_location("bench_middleware", BENCHMARK)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class BenchmarkTest(unittest.TestCase):
+
+    def test_smoke(self):
+        bench = load_benchmark()
+        with tempfile.NamedTemporaryFile(suffix=".json") as output:
+            self.assertEqual(0, bench.main([
+                "--scenario", "global-limits", "--requests", "5", "--warmup", "1",
+                "--json", output.name
+            ]))
+            with open(output.name) as results_file:
+                results = json.load(results_file)["results"]
+        self.assertTrue(results)
+        for result in results:
+            self.assertEqual("global-limits", result["scenario"])
+            self.assertEqual(0, result["rejected"])
+            self.assertTrue(result["requests_per_second"] > 0)
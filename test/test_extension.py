@@ -1,8 +1,13 @@
+import asyncio
 import unittest
 from unittest import mock
 import logging
+import time
+from types import SimpleNamespace
 
+from limits.errors import ConfigurationError
 from limits.strategies import MovingWindowRateLimiter
+from limits.util import parse_many
 from limits.storage import MemoryStorage
 from sanic import Sanic, Blueprint
 from sanic.response import text
@@ -10,6 +15,16 @@ from sanic.response import text
 from sanic_limiter.util import get_remote_address
 from sanic_limiter import Limiter
 from sanic_limiter.extension import C
+from sanic_limiter.metrics import PrometheusMetrics
+from sanic_limiter.storage import (
+    AsyncMemoryStorage, AsyncShardedStorage, AsyncStorage, LocalCounterStorage
+)
+from sanic_limiter.strategies import AsyncMovingWindowRateLimiter
+
+
+def view_function(route):
+    # the route decorators of sanic 19.x return the routes with the handler
+    return route[1] if isinstance(route, tuple) else route
 
 
 class SanicLimiterTest(unittest.TestCase):
@@ -50,6 +65,327 @@ class SanicLimiterTest(unittest.TestCase):
         self.assertEqual(limiter.enabled, False)
         self.assertEqual(limiter._swallow_errors, True)
 
+    def test_async_storage(self):
+        app, limiter = self.build_app(global_limits=['2/day'], strategy='moving-window',
+                                      storage_uri='async+memory://')
+        self.assertTrue(isinstance(limiter._storage, AsyncMemoryStorage))
+        self.assertTrue(isinstance(limiter.limiter, AsyncMovingWindowRateLimiter))
+
+        @app.route("/t1")
+        async def t1(request):
+            return text("t1")
+
+        cli = app.test_client
+        self.assertEqual(200, cli.get("/t1")[1].status)
+        self.assertEqual(200, cli.get("/t1")[1].status)
+        self.assertEqual(429, cli.get("/t1")[1].status)
+
+    def test_sharded_storage(self):
+        app, limiter = self.build_app(
+            {C.STORAGE_URL: ['async+memory://a', 'async+memory://b']},
+            global_limits=['2/day;5/minute'], key_func=lambda: 'k'
+        )
+        self.assertTrue(isinstance(limiter._storage, AsyncShardedStorage))
+
+        @app.route("/t1")
+        async def t1(request):
+            return text("t1")
+
+        cli = app.test_client
+        self.assertEqual(200, cli.get("/t1")[1].status)
+        self.assertEqual(200, cli.get("/t1")[1].status)
+        self.assertEqual(429, cli.get("/t1")[1].status)
+        self.assertRaises(
+            ConfigurationError, self.build_app,
+            {C.STORAGE_URL: ['async+memory://', 'memory://']}
+        )
+
+    def test_storage_built_on_first_use(self):
+        with mock.patch.object(AsyncStorage, "close") as close:
+            app, limiter = self.build_app(
+                {C.STORAGE_FAILURE_THRESHOLD: 1, C.IN_MEMORY_FALLBACK_ENABLED: True},
+                global_limits=['1/day'], storage_uri='async+memory+lru://'
+            )
+
+            @app.route("/t1")
+            @limiter.concurrency_limit(1)
+            async def t1(request):
+                return text("t1")
+
+            # servers not running the listeners of the limiter
+            del app.listeners['before_server_start'][:]
+            cli = app.test_client
+            self.assertEqual(200, cli.get("/t1")[1].status)
+            self.assertEqual(429, cli.get("/t1")[1].status)
+            # the storage, the lease storage and the fallback storage
+            self.assertEqual(6, close.call_count)
+
+    def test_storage_per_worker(self):
+        with mock.patch(
+            "sanic_limiter.extension.storage_from_string",
+            side_effect=lambda uri, **options: AsyncMemoryStorage()
+        ) as build, mock.patch.object(AsyncMemoryStorage, "close") as close:
+            app, limiter = self.build_app(
+                global_limits=['1/day'], storage_uri='async+memory://'
+            )
+
+            @app.route("/t1")
+            async def t1(request):
+                return text("t1")
+
+            # nothing is built until the server starts
+            self.assertEqual(0, build.call_count)
+            cli = app.test_client
+            self.assertEqual(200, cli.get("/t1")[1].status)
+            self.assertEqual(1, build.call_count)
+            self.assertEqual(1, close.call_count)
+            self.assertEqual(429, cli.get("/t1")[1].status)
+            self.assertEqual(1, build.call_count)
+            # a forked worker builds its own storage
+            with mock.patch("os.getpid", return_value=-1):
+                self.assertEqual(200, cli.get("/t1")[1].status)
+            self.assertEqual(2, build.call_count)
+
+    def test_async_strategies(self):
+        for strategy in ['gcra', 'sliding-window-counter']:
+            app, limiter = self.build_app(
+                {C.STRATEGY: strategy}, global_limits=['2/day'],
+                storage_uri='async+memory://', key_func=lambda: 'k'
+            )
+
+            @app.route("/t1")
+            async def t1(request):
+                return text("t1")
+
+            cli = app.test_client
+            self.assertEqual(200, cli.get("/t1")[1].status)
+            self.assertEqual(200, cli.get("/t1")[1].status)
+            self.assertEqual(429, cli.get("/t1")[1].status)
+            self.assertRaises(ConfigurationError, self.build_app, {C.STRATEGY: strategy})
+
+    def test_hit_cost(self):
+        app, limiter = self.build_app(storage_uri='async+memory://', key_func=lambda: 'k')
+
+        @app.route("/bulk", methods=["POST"])
+        @limiter.limit("10/minute", cost=lambda request: len(request.json))
+        async def bulk(request):
+            return text("bulk")
+
+        @app.route("/export")
+        @limiter.shared_limit("10/minute", "exports", cost=4)
+        async def export(request):
+            return text("export")
+
+        @app.route("/items")
+        @limiter.limit("5/minute", cost=lambda request: int(request.args.get("n")))
+        async def items(request):
+            return text("items")
+
+        cli = app.test_client
+        self.assertEqual(200, cli.post("/bulk", json=list(range(8)))[1].status)
+        self.assertEqual(429, cli.post("/bulk", json=list(range(3)))[1].status)
+        self.assertEqual(200, cli.post("/bulk", json=list(range(2)))[1].status)
+        self.assertEqual(200, cli.get("/export")[1].status)
+        self.assertEqual(200, cli.get("/export")[1].status)
+        self.assertEqual(429, cli.get("/export")[1].status)
+
+        # a negative cost would take hits back
+        self.assertEqual(429, cli.get("/items?n=-5")[1].status)
+        self.assertEqual(200, cli.get("/items?n=5")[1].status)
+        self.assertEqual(429, cli.get("/items?n=1")[1].status)
+
+        app, limiter = self.build_app()
+        self.assertRaises(ConfigurationError, limiter.limit, "1/minute", cost=2)
+        app, limiter = self.build_app(storage_uri='async+memory://')
+        self.assertRaises(ConfigurationError, limiter.limit, "1/minute", cost=-1)
+
+    def test_batch_hits(self):
+        app, limiter = self.build_app({C.BATCH_HITS: True}, storage_uri='async+memory://',
+                                      key_func=lambda: 'k')
+
+        @app.route("/t1")
+        @limiter.limit("2/minute;3/hour")
+        async def t1(request):
+            return text("t1")
+
+        cli = app.test_client
+        self.assertEqual(200, cli.get("/t1")[1].status)
+        self.assertEqual(200, cli.get("/t1")[1].status)
+        response = cli.get("/t1")[1]
+        self.assertEqual(429, response.status)
+        self.assertIn('2 per 1 minute', response.body.decode())
+        hour = limiter._route_limits['test.test_extension.t1'][1].limit
+        self.assertEqual(2, limiter._storage.storage[hour.key_for('k', '/t1')])
+
+    def test_batch_hits_headers(self):
+        app, limiter = self.build_app({C.BATCH_HITS: True, C.HEADERS_ENABLED: True},
+                                      storage_uri='async+memory://', key_func=lambda: 'k')
+
+        @app.route("/t1")
+        @limiter.limit("3/minute;2/hour")
+        async def t1(request):
+            return text("t1")
+
+        cli = app.test_client
+        # the windows are returned by the batched storage call
+        with mock.patch.object(AsyncMemoryStorage, 'get') as get:
+            response = cli.get("/t1")[1]
+            self.assertEqual("2", response.headers["X-RateLimit-Limit"])
+            self.assertEqual("1", response.headers["X-RateLimit-Remaining"])
+            reset = int(response.headers["X-RateLimit-Reset"])
+            self.assertTrue(time.time() + 3500 < reset <= time.time() + 3601)
+            self.assertEqual("0", cli.get("/t1")[1].headers["X-RateLimit-Remaining"])
+            response = cli.get("/t1")[1]
+            self.assertEqual(429, response.status)
+            self.assertEqual("2", response.headers["X-RateLimit-Limit"])
+            self.assertEqual(str(reset), response.headers["X-RateLimit-Reset"])
+            self.assertFalse(get.called)
+
+    def test_local_counting(self):
+        app, limiter = self.build_app({C.LOCAL_SYNC_INTERVAL: 60, C.LOCAL_SYNC_HITS: 5},
+                                      storage_uri='async+memory://', global_limits=['2/minute'])
+        self.assertTrue(isinstance(limiter._storage, LocalCounterStorage))
+
+        @app.route("/t1")
+        async def t1(request):
+            return text("t1")
+
+        cli = app.test_client
+        self.assertEqual(200, cli.get("/t1")[1].status)
+        self.assertEqual(200, cli.get("/t1")[1].status)
+        self.assertEqual(429, cli.get("/t1")[1].status)
+        # pending hits are pushed when the server stops
+        self.assertEqual(3, sum(limiter._storage.storage.storage.values()))
+
+    def test_local_counting_requires_async_storage(self):
+        self.assertRaises(ConfigurationError, self.build_app, {C.LOCAL_SYNC_INTERVAL: 1})
+
+    def test_unsupported_strategy_storage(self):
+        for strategy, storage_uri, config in [
+            ('gcra', 'async+memcached://localhost:11211', {}),
+            ('sliding-window-counter', 'async+memcached://localhost:11211', {}),
+            ('moving-window', 'async+shm:///tmp/sanic-limiter-test', {}),
+            ('moving-window', 'memcached://localhost:11211', {}),
+            ('moving-window', ['async+memory://a', 'async+shm:///tmp/sanic-limiter-test'], {}),
+            ('gcra', 'async+memory://', {C.LOCAL_SYNC_INTERVAL: 1}),
+            ('sliding-window-counter', 'async+memory://', {C.LOCAL_SYNC_INTERVAL: 1}),
+            ('moving-window', 'async+memory://', {C.LOCAL_SYNC_INTERVAL: 1}),
+        ]:
+            # rejected before the storage is built
+            with mock.patch('sanic_limiter.extension.storage_from_string') as build:
+                self.assertRaises(
+                    ConfigurationError, self.build_app, config, strategy=strategy,
+                    storage_uri=storage_uri
+                )
+                self.assertRaises(
+                    ConfigurationError, self.build_app,
+                    dict(config, **{C.STRATEGY: strategy, C.STORAGE_URL: storage_uri})
+                )
+                self.assertFalse(build.called)
+        for strategy in ('gcra', 'sliding-window-counter'):
+            self.build_app(strategy=strategy, storage_uri='async+shm:///tmp/sanic-limiter-test')
+        self.build_app(
+            {C.LOCAL_SYNC_INTERVAL: 1}, strategy='fixed-window',
+            storage_uri='async+memcached://localhost:11211'
+        )
+
+    def test_storage_circuit_breaker(self):
+        app, limiter = self.build_app({C.STORAGE_FAILURE_THRESHOLD: 2, C.SWALLOW_ERRORS: True},
+                                      storage_uri='async+memory://', global_limits=['1/minute'],
+                                      storage_recovery_interval=60)
+
+        @app.route("/t1")
+        async def t1(request):
+            return text("t1")
+
+        cli = app.test_client
+        with mock.patch.object(limiter._storage, 'incr', side_effect=ConnectionError) as incr:
+            for _ in range(4):
+                self.assertEqual(200, cli.get("/t1")[1].status)
+            self.assertEqual(2, incr.call_count)
+            self.assertTrue(limiter._storage_dead)
+        limiter._breaker.recovery_interval = 0
+        asyncio.new_event_loop().run_until_complete(limiter._Limiter__probe_storage())
+        self.assertFalse(limiter._storage_dead)
+        self.assertEqual(200, cli.get("/t1")[1].status)
+        self.assertEqual(429, cli.get("/t1")[1].status)
+        self.assertEqual({'open': 1, 'closed': 1}, limiter._breaker.transitions)
+
+    def test_storage_in_memory_fallback(self):
+        app, limiter = self.build_app({C.STORAGE_FAILURE_THRESHOLD: 1, C.IN_MEMORY_FALLBACK_ENABLED: True},
+                                      global_limits=['1/minute'])
+
+        @app.route("/t1")
+        async def t1(request):
+            return text("t1")
+
+        cli = app.test_client
+        with mock.patch.object(limiter._storage, 'incr', side_effect=ConnectionError), \
+                mock.patch.object(limiter._storage, 'check', return_value=False):
+            self.assertEqual(500, cli.get("/t1")[1].status)
+            self.assertTrue(limiter._storage_dead)
+            self.assertEqual(200, cli.get("/t1")[1].status)
+            self.assertEqual(429, cli.get("/t1")[1].status)
+
+    def test_metrics(self):
+        metrics = PrometheusMetrics()
+        app, limiter = self.build_app(global_limits=['1/minute'], metrics=metrics)
+
+        @app.route("/t1")
+        async def t1(request):
+            return text("t1")
+
+        @app.route("/t2")
+        @limiter.exempt
+        async def t2(request):
+            return text("t2")
+
+        cli = app.test_client
+        self.assertEqual(200, cli.get("/t1")[1].status)
+        self.assertEqual(429, cli.get("/t1")[1].status)
+        self.assertEqual(200, cli.get("/t2")[1].status)
+        self.assertEqual({'/t1': 1}, metrics.hits)
+        self.assertEqual({'/t1': 1}, metrics.rejections)
+        self.assertEqual({'test.test_extension.t2': 1}, metrics.exemptions)
+        self.assertEqual(2, metrics.storage_latency.count)
+        self.assertEqual(2, metrics.key_latency.count)
+        rendered = metrics.render()
+        self.assertIn('sanic_limiter_rejections_total{scope="/t1"} 1', rendered)
+        self.assertIn('sanic_limiter_storage_seconds_bucket{le="+Inf"} 2', rendered)
+        self.assertIn('sanic_limiter_storage_errors_total 0', rendered)
+
+    def test_headers(self):
+        for storage_uri in ["memory://", "async+memory://"]:
+            app, limiter = self.build_app(
+                config={C.HEADERS_ENABLED: True}, storage_uri=storage_uri,
+                key_func=lambda: "k"
+            )
+
+            @app.route("/t1")
+            @limiter.limit("2/minute;5/hour")
+            async def t1(request):
+                return text("t1")
+
+            @app.route("/t2")
+            @limiter.exempt
+            async def t2(request):
+                return text("t2")
+
+            cli = app.test_client
+            response = cli.get("/t1")[1]
+            self.assertEqual("2", response.headers["X-RateLimit-Limit"])
+            self.assertEqual("1", response.headers["X-RateLimit-Remaining"])
+            reset = int(response.headers["X-RateLimit-Reset"])
+            self.assertTrue(time.time() < reset <= time.time() + 61)
+            self.assertNotIn("Retry-After", response.headers)
+            response = cli.get("/t1")[1]
+            self.assertEqual("0", response.headers["X-RateLimit-Remaining"])
+            response = cli.get("/t1")[1]
+            self.assertEqual(429, response.status)
+            self.assertEqual("0", response.headers["X-RateLimit-Remaining"])
+            self.assertTrue(0 < int(response.headers["Retry-After"]) <= 60)
+            self.assertNotIn("X-RateLimit-Limit", cli.get("/t2")[1].headers)
+
     def test_limiter_response(self):
         app, limiter = self.build_app(config={}, global_limits=['1/day'])
 
@@ -116,6 +452,63 @@ class SanicLimiterTest(unittest.TestCase):
         self.assertEqual(429, cli.get("/t1")[1].status)
         self.assertEqual(429, cli.get("/t1")[1].status)
 
+    def test_key_func_called_once(self):
+        calls = []
+
+        def key_func(request):
+            calls.append(request.path)
+            return 'k'
+
+        app, limiter = self.build_app(key_func=key_func)
+
+        @app.route("/t1")
+        @limiter.limit("100/minute;1000/hour")
+        @limiter.limit(lambda: "10/minute")
+        async def t1(request):
+            return text("t1")
+
+        self.assertEqual(200, app.test_client.get("/t1")[1].status)
+        self.assertEqual(["/t1"], calls)
+
+    def test_dynamic_limit_parsed_once(self):
+        app, limiter = self.build_app()
+        tiers = ["2/minute", "3/minute"]
+
+        @app.route("/t1")
+        @limiter.limit(lambda: tiers[0])
+        async def t1(request):
+            return text("t1")
+
+        cli = app.test_client
+        with mock.patch('sanic_limiter.extension.parse_many', wraps=parse_many) as parse:
+            self.assertEqual(200, cli.get("/t1")[1].status)
+            self.assertEqual(200, cli.get("/t1")[1].status)
+            self.assertEqual(429, cli.get("/t1")[1].status)
+            self.assertEqual(1, parse.call_count)
+            tiers.reverse()
+            for _ in range(3):
+                self.assertEqual(200, cli.get("/t1")[1].status)
+            self.assertEqual(429, cli.get("/t1")[1].status)
+            self.assertEqual(2, parse.call_count)
+
+    def test_dynamic_limit_restricted_to_methods(self):
+        app, limiter = self.build_app(global_limits=["1/day"])
+        tiers = ["2/minute"]
+
+        @limiter.limit(lambda: tiers[0], methods=["POST"])
+        @app.route("/t1", methods=["GET", "POST"])
+        async def t1(request):
+            return text("t1")
+
+        cli = app.test_client
+        # the global limits do not apply to the methods the dynamic limit skips
+        self.assertEqual([200, 200, 200], [cli.get("/t1")[1].status for _ in range(3)])
+        self.assertEqual([200, 200, 429], [cli.post("/t1")[1].status for _ in range(3)])
+        # but stand in for a dynamic limit which fails to load
+        tiers[0] = "invalid"
+        self.assertEqual([200, 429], [cli.post("/t1")[1].status for _ in range(2)])
+        self.assertEqual(200, cli.get("/t1")[1].status)
+
     def test_exempt_routes(self):
         app, limiter = self.build_app(global_limits=["1/day"])
 
@@ -134,6 +527,448 @@ class SanicLimiterTest(unittest.TestCase):
         self.assertEqual(cli.get("/t2")[1].status, 200)
         self.assertEqual(cli.get("/t2")[1].status, 200)
 
+    def test_rejection_cache(self):
+        for storage_uri in ["memory://", "async+memory://"]:
+            app, limiter = self.build_app(
+                {C.REJECTION_CACHE_ENABLED: True, C.HEADERS_ENABLED: True},
+                global_limits=["1/minute;10/hour"], storage_uri=storage_uri,
+                key_func=lambda: "k"
+            )
+
+            @app.route("/t1")
+            async def t1(request):
+                return text("test")
+
+            cli = app.test_client
+            self.assertEqual(cli.get("/t1")[1].status, 200)
+            self.assertEqual(cli.get("/t1")[1].status, 429)
+            self.assertEqual(1, len(limiter._rejections))
+            with mock.patch.object(limiter.limiter, "hit") as hit:
+                response = cli.get("/t1")[1]
+                self.assertEqual(response.status, 429)
+                self.assertEqual("1", response.headers["X-RateLimit-Limit"])
+                self.assertFalse(hit.called)
+            # the cached rejection did not hit the hourly limit either
+            hourly = parse_many("10/hour")[0]
+            stats = limiter.limiter.get_window_stats(hourly, "k", "/t1")
+            if asyncio.iscoroutine(stats):
+                stats = asyncio.new_event_loop().run_until_complete(stats)
+            self.assertEqual(9, stats[1])
+
+    def test_request_filters(self):
+        app, limiter = self.build_app(
+            {C.FILTER_CACHE_TTL: 60}, global_limits=["1/day"], key_func=lambda: "k"
+        )
+        calls = []
+
+        @limiter.request_filter
+        async def allowlisted(request):
+            calls.append(request.path)
+            await asyncio.sleep(0)
+            return request.args.get("allow") == "1"
+
+        @limiter.request_filter
+        def legacy():
+            return False
+
+        @app.route("/t1")
+        @limiter.limit("1/day", exempt_when=lambda request: request.args.get("vip") == "1")
+        async def t1(request):
+            return text("test")
+
+        cli = app.test_client
+        self.assertEqual(cli.get("/t1?allow=1")[1].status, 200)
+        # the cached result of the filter is used for the same key
+        self.assertEqual(cli.get("/t1")[1].status, 200)
+        self.assertEqual(["/t1"], calls)
+        limiter._filter_cache.clear()
+        self.assertEqual(cli.get("/t1")[1].status, 200)
+        self.assertEqual(cli.get("/t1")[1].status, 429)
+        limiter._filter_cache.clear()
+        self.assertEqual(cli.get("/t1?vip=1")[1].status, 200)
+
+    def test_exempt_when_exempts_route(self):
+        app, limiter = self.build_app(global_limits=["1/day"], key_func=lambda: "k")
+
+        @app.route("/t1")
+        @limiter.limit("1/minute")
+        @limiter.limit("1/hour", exempt_when=lambda request: request.args.get("vip") == "1")
+        async def t1(request):
+            return text("test")
+
+        @app.route("/t2")
+        async def t2(request):
+            return text("test")
+
+        cli = app.test_client
+        # the exemption of one limit exempts the request from all limits
+        self.assertEqual(200, cli.get("/t1?vip=1")[1].status)
+        self.assertEqual(200, cli.get("/t1?vip=1")[1].status)
+        # and none of them was counted
+        self.assertEqual(200, cli.get("/t1")[1].status)
+        self.assertEqual(429, cli.get("/t1")[1].status)
+        self.assertEqual(200, cli.get("/t2")[1].status)
+
+    def test_delay(self):
+        metrics = PrometheusMetrics()
+        app, limiter = self.build_app(key_func=lambda: "k", metrics=metrics)
+
+        @app.route("/t1")
+        @limiter.limit("1/second", max_delay=2)
+        async def t1(request):
+            return text("test")
+
+        @app.route("/t2")
+        @limiter.limit("1/minute", max_delay=2)
+        async def t2(request):
+            return text("test")
+
+        @app.route("/t3")
+        @limiter.limit("1/second", max_delay=2, max_queue=0)
+        async def t3(request):
+            return text("test")
+
+        cli = app.test_client
+        self.assertEqual(200, cli.get("/t1")[1].status)
+        start = time.time()
+        # waits for the next window instead of being rejected
+        self.assertEqual(200, cli.get("/t1")[1].status)
+        self.assertLess(time.time() - start, 1.5)
+        self.assertEqual({"/t1": 1}, metrics.delays)
+        self.assertEqual(1, metrics.delay_latency.count)
+        self.assertTrue(0 < metrics.delay_latency.sum < 1.5)
+        self.assertIn("sanic_limiter_delay_seconds_count 1\n", metrics.render())
+        self.assertEqual(200, cli.get("/t2")[1].status)
+        # the next window is further away than the maximum delay
+        self.assertEqual(429, cli.get("/t2")[1].status)
+        self.assertEqual(200, cli.get("/t3")[1].status)
+        # no request may wait
+        self.assertEqual(429, cli.get("/t3")[1].status)
+        self.assertEqual({}, limiter._queues)
+
+    def test_delay_elastic_expiry(self):
+        app, limiter = self.build_app(
+            key_func=lambda: "k", strategy="fixed-window-elastic-expiry",
+            storage_uri="async+memory://"
+        )
+
+        @app.route("/t1")
+        @limiter.limit("1/second", max_delay=3)
+        async def t1(request):
+            return text("test")
+
+        cli = app.test_client
+        self.assertEqual(200, cli.get("/t1")[1].status)
+        start = time.time()
+        # retries hitting the limit would push its window out every time
+        self.assertEqual(200, cli.get("/t1")[1].status)
+        self.assertLess(time.time() - start, 1.6)
+
+    def test_delay_batch_hits(self):
+        app, limiter = self.build_app(
+            {C.BATCH_HITS: True, C.STORAGE_URL: "async+memory://"},
+            key_func=lambda: "k"
+        )
+
+        @app.route("/t1")
+        @limiter.limit("1/second;10/minute", max_delay=2)
+        async def t1(request):
+            return text("test")
+
+        cli = app.test_client
+        self.assertEqual(200, cli.get("/t1")[1].status)
+        self.assertEqual(200, cli.get("/t1")[1].status)
+        minutely = parse_many("10/minute")[0]
+        stats = asyncio.new_event_loop().run_until_complete(
+            limiter.limiter.get_window_stats(minutely, "k", "/t1")
+        )
+        self.assertEqual(8, stats[1])
+
+    def test_delay_batch_hits_staggered_resets(self):
+        app, limiter = self.build_app(
+            {C.BATCH_HITS: True, C.STORAGE_URL: "async+memory://"},
+            strategy="moving-window", key_func=lambda: "k"
+        )
+
+        @app.route("/t1")
+        @limiter.limit("1/second;2 per 3 seconds", max_delay=3)
+        async def t1(request):
+            return text("test")
+
+        cli = app.test_client
+        self.assertEqual(200, cli.get("/t1")[1].status)
+        time.sleep(1.1)
+        self.assertEqual(200, cli.get("/t1")[1].status)
+        # waits for the limit per second, then for the window of three
+        # seconds which frees a slot later
+        start = time.time()
+        self.assertEqual(200, cli.get("/t1")[1].status)
+        self.assertTrue(1.5 < time.time() - start < 3, time.time() - start)
+        self.assertEqual({}, limiter._queues)
+
+    def test_concurrency_limit(self):
+        app, limiter = self.build_app(key_func=lambda: "k")
+        held = []
+
+        @app.route("/t1")
+        @limiter.concurrency_limit(1)
+        async def t1(request):
+            held.append(dict(limiter._lease_storage.leases))
+            return text("test")
+
+        @app.route("/t2")
+        @limiter.concurrency_limit(1, scope="shared")
+        async def t2(request):
+            raise ValueError("failed")
+
+        cli = app.test_client
+        self.assertEqual(200, cli.get("/t1")[1].status)
+        self.assertEqual(["LIMITER/concurrency/k//t1"], list(held[0]))
+        # the slot is released after the response
+        self.assertEqual({}, limiter._lease_storage.leases)
+        self.assertEqual(200, cli.get("/t1")[1].status)
+        # and when the handler raises
+        self.assertEqual(500, cli.get("/t2")[1].status)
+        self.assertEqual({}, limiter._lease_storage.leases)
+        # a slot held by another request is not available until its ttl
+        limiter._lease_storage.leases["LIMITER/concurrency/k/shared"] = {
+            0: time.time() + 60
+        }
+        self.assertEqual(429, cli.get("/t2")[1].status)
+        limiter._lease_storage.leases["LIMITER/concurrency/k/shared"] = {
+            0: time.time() - 1
+        }
+        self.assertEqual(500, cli.get("/t2")[1].status)
+
+    def test_concurrency_reuses_route_and_keys(self):
+        calls = []
+
+        def key_func():
+            calls.append(1)
+            return "k"
+
+        app, limiter = self.build_app(key_func=key_func)
+
+        @app.route("/t1")
+        @limiter.limit("5/minute")
+        @limiter.concurrency_limit(1)
+        async def t1(request):
+            return text("test")
+
+        with mock.patch.object(
+            Limiter, "_Limiter__resolve_route", autospec=True,
+            side_effect=Limiter._Limiter__resolve_route
+        ) as resolve_route:
+            self.assertEqual(200, app.test_client.get("/t1")[1].status)
+        self.assertEqual(1, resolve_route.call_count)
+        self.assertEqual(1, len(calls))
+
+    def test_concurrency_released_on_cancel(self):
+        app, limiter = self.build_app(key_func=lambda: "k")
+
+        @app.route("/t1")
+        @limiter.concurrency_limit(1)
+        async def t1(request):
+            return text("test")
+
+        request = SimpleNamespace(
+            path="/t1", method="GET", remote_addr="127.0.0.1", headers={},
+            args={}, ctx=SimpleNamespace()
+        )
+
+        async def handle():
+            for middleware in app.request_middleware:
+                result = middleware(request)
+                if result is not None:
+                    await result
+            # the client disconnects while the handler runs
+            await asyncio.sleep(60)
+
+        async def disconnect():
+            task = asyncio.ensure_future(handle())
+            await asyncio.sleep(0.01)
+            self.assertEqual(
+                1, len(limiter._lease_storage.leases["LIMITER/concurrency/k//t1"])
+            )
+            task.cancel()
+            await asyncio.sleep(0.01)
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(disconnect())
+        finally:
+            loop.close()
+        self.assertEqual({}, limiter._lease_storage.leases)
+
+    def test_global_concurrency(self):
+        app, limiter = self.build_app(
+            {C.GLOBAL_CONCURRENCY: 2}, key_func=lambda: "k"
+        )
+        bp = Blueprint("bp", url_prefix="/bp")
+        limiter.concurrency_limit(1)(bp)
+
+        @app.route("/t1")
+        async def t1(request):
+            return text("test")
+
+        @app.route("/t2")
+        @limiter.exempt
+        async def t2(request):
+            return text("test")
+
+        @bp.route("/t3")
+        async def t3(request):
+            return text("test")
+
+        app.blueprint(bp)
+        plans = [
+            [c.limit for c in limiter._Limiter__route_plan(view_function(handler)).concurrency]
+            for handler in (t1, t2, t3)
+        ]
+        self.assertEqual([[2], [], [1]], plans)
+        cli = app.test_client
+        self.assertEqual(200, cli.get("/t1")[1].status)
+        self.assertEqual(200, cli.get("/bp/t3")[1].status)
+        self.assertEqual({}, limiter._lease_storage.leases)
+
+    def test_address_lists(self):
+        metrics = PrometheusMetrics()
+        app, limiter = self.build_app(
+            {C.DENYLIST: ["127.0.0.2/32"]}, global_limits=["1/day"],
+            allowlist=["127.0.0.0/8"], key_func=lambda: "k", metrics=metrics
+        )
+
+        @app.route("/t1")
+        async def t1(request):
+            return text("test")
+
+        cli = app.test_client
+        self.assertEqual(200, cli.get("/t1")[1].status)
+        self.assertEqual(200, cli.get("/t1")[1].status)
+        self.assertEqual({"t1": 2}, {
+            name.split(".")[-1]: count for name, count in metrics.exemptions.items()
+        })
+        limiter._denylist.add("127.0.0.1")
+        self.assertEqual(429, cli.get("/t1")[1].status)
+
+    def test_compact_keys(self):
+        app, limiter = self.build_app(
+            {C.COMPACT_KEYS: True, C.STORAGE_URL: "async+memory://"},
+            key_func=lambda: "2001:db8:1:2:3:4:5:6"
+        )
+
+        @app.route("/api/v1/users/<user>/orders")
+        @limiter.limit("1/minute;10/hour", per_method=True)
+        async def orders(request, user):
+            return text("test")
+
+        cli = app.test_client
+        self.assertEqual(200, cli.get("/api/v1/users/42/orders")[1].status)
+        self.assertEqual(429, cli.get("/api/v1/users/42/orders")[1].status)
+        self.assertEqual(200, cli.get("/api/v1/users/43/orders")[1].status)
+        keys = list(limiter._storage.storage)
+        self.assertEqual(4, len(keys))
+        self.assertTrue(all(len(key) == limiter._compact_keys.length for key in keys))
+
+    def test_heavy_hitters(self):
+        app, limiter = self.build_app(
+            {C.HEAVY_HITTERS: 10, C.HEAVY_HITTER_THRESHOLD: 3,
+             C.HEAVY_HITTER_LIMIT: "2/day"},
+            global_limits=["100/day"], key_func=lambda: "k"
+        )
+
+        @app.route("/t1")
+        async def t1(request):
+            return text("test")
+
+        @app.route("/t2")
+        async def t2(request):
+            return text("test")
+
+        cli = app.test_client
+        for _ in range(4):
+            self.assertEqual(200, cli.get("/t1")[1].status)
+        # the third and fourth hit were heavy and hit the stricter limit
+        self.assertEqual(429, cli.get("/t1")[1].status)
+        self.assertEqual(200, cli.get("/t2")[1].status)
+        self.assertEqual([("k", "/t1", 5), ("k", "/t2", 1)], limiter.heavy_hitters())
+        self.assertEqual([("k", "/t1", 5)], limiter.heavy_hitters(1))
+
+    def test_adaptive_limits(self):
+        app, limiter = self.build_app(
+            {C.ADAPTIVE_ENABLED: True, C.HEADERS_ENABLED: True},
+            global_limits=["4/day"], key_func=lambda: "k"
+        )
+
+        @app.route("/t1")
+        async def t1(request):
+            return text("test")
+
+        cli = app.test_client
+        limiter._load_monitor.factor = 0.5
+        response = cli.get("/t1")[1]
+        self.assertEqual("2", response.headers["X-RateLimit-Limit"])
+        self.assertEqual(200, cli.get("/t1")[1].status)
+        self.assertEqual(429, cli.get("/t1")[1].status)
+        limiter._load_monitor.factor = 1.0
+        response = cli.get("/t1")[1]
+        self.assertEqual(200, response.status)
+        self.assertEqual("4", response.headers["X-RateLimit-Limit"])
+        self.assertEqual(0, limiter._load_monitor.in_flight)
+
+    def test_adaptive_headers_use_scale_of_hit(self):
+        app, limiter = self.build_app(
+            {C.ADAPTIVE_ENABLED: True, C.HEADERS_ENABLED: True},
+            global_limits=["4/day"], key_func=lambda: "k"
+        )
+
+        @app.route("/t1")
+        async def t1(request):
+            # the worker recovers while the request is handled
+            limiter._load_monitor.factor = 1.0
+            return text("test")
+
+        limiter._load_monitor.factor = 0.5
+        response = app.test_client.get("/t1")[1]
+        self.assertEqual("2", response.headers["X-RateLimit-Limit"])
+        self.assertEqual("1", response.headers["X-RateLimit-Remaining"])
+
+    def test_adaptive_in_flight_released_on_cancel(self):
+        app, limiter = self.build_app(
+            {C.ADAPTIVE_ENABLED: True}, global_limits=["4/day"], key_func=lambda: "k"
+        )
+
+        @app.route("/t1")
+        async def t1(request):
+            return text("test")
+
+        request = SimpleNamespace(
+            path="/t1", method="GET", remote_addr="127.0.0.1", headers={},
+            args={}, ctx=SimpleNamespace()
+        )
+
+        async def handle():
+            for middleware in app.request_middleware:
+                result = middleware(request)
+                if result is not None:
+                    await result
+            # the client disconnects while the handler runs
+            await asyncio.sleep(60)
+
+        async def disconnect():
+            task = asyncio.ensure_future(handle())
+            await asyncio.sleep(0.01)
+            self.assertEqual(1, limiter._load_monitor.in_flight)
+            task.cancel()
+            await asyncio.sleep(0.01)
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(disconnect())
+        finally:
+            loop.close()
+        self.assertEqual(0, limiter._load_monitor.in_flight)
+
     def test_explicit_method_limits(self):
         app, limiter = self.build_app()
 
@@ -162,6 +997,59 @@ class SanicLimiterTest(unittest.TestCase):
         self.assertEqual(200, cli.get("/t1/two")[1].status)
         self.assertEqual(429, cli.get("/t1/two")[1].status)
 
+    def test_route_plan(self):
+        app, limiter = self.build_app(global_limits=['1/day'])
+
+        @app.route("/t1", methods=["GET", "POST"])
+        @limiter.limit("2/minute;10/hour", per_method=True)
+        async def t1(request):
+            return text("t1")
+
+        @app.route("/t2")
+        async def t2(request):
+            return text("t2")
+
+        cli = app.test_client
+        self.assertEqual(200, cli.get("/t1")[1].status)
+        plan = limiter._route_plans[view_function(t1)]
+        self.assertEqual(2, len(plan.for_method("GET")))
+        self.assertEqual(["/t1:GET", "/t1:GET"], ["/t1" + e.suffix for e in plan.for_method("GET")])
+        self.assertEqual(limiter._global_limits, [e.limit for e in limiter._route_plans[view_function(t2)].for_method("GET")])
+        self.assertEqual(200, cli.get("/t1")[1].status)
+        self.assertEqual(429, cli.get("/t1")[1].status)
+        self.assertEqual(200, cli.post("/t1")[1].status)
+
+        limiter.exempt(t2)
+        self.assertEqual({}, limiter._route_plans)
+        self.assertEqual(200, cli.get("/t2")[1].status)
+        self.assertEqual(200, cli.get("/t2")[1].status)
+
+    def test_resolve_route(self):
+        app, limiter = self.build_app()
+
+        async def t1(request):
+            return text("t1")
+
+        # sanic<19.9 routes to (handler, args, kwargs, uri), later releases
+        # append the name of the route
+        for match in [(t1, [], {}, "/t1/<path>"), (t1, [], {}, "/t1/<path>", "t1")]:
+            with mock.patch.object(app.router, "get", return_value=match):
+                route = limiter._Limiter__resolve_route(mock.Mock(spec=[]))
+            self.assertEqual((t1, "/t1/<path>"), tuple(route))
+
+    def test_dynamic_route_scope_by_route(self):
+        app, limiter = self.build_app({C.SCOPE_BY_ROUTE: True})
+
+        @limiter.limit("1/minute")
+        @app.route("/t1/<path>")
+        async def t1(request, path):
+            return text(path)
+
+        cli = app.test_client
+        self.assertEqual(200, cli.get("/t1/one")[1].status)
+        self.assertEqual(429, cli.get("/t1/two")[1].status)
+        self.assertEqual(404, cli.get("/t2")[1].status)
+
     def test_bp_limit(self):
         app, limiter = self.build_app(config={}, global_limits=['1/day'])
         bp = Blueprint('/bp')
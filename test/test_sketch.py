@@ -0,0 +1,46 @@
+import time
+import unittest
+from unittest import mock
+
+from sanic_limiter.sketch import CountMinSketch, HeavyHitters
+
+
+class CountMinSketchTest(unittest.TestCase):
+
+    def test_estimates(self):
+        sketch = CountMinSketch(width=256, depth=4)
+        for i in range(1000):
+            sketch.add("key%d" % i)
+        estimate = sketch.add("hot", 1000)
+        # never below the true count, rarely far above it
+        self.assertGreaterEqual(estimate, 1000)
+        self.assertLess(estimate, 1000 + 2 * 2000 // 256)
+        self.assertGreaterEqual(sketch.estimate("key1"), 1)
+        self.assertLess(sketch.estimate("key1"), 1 + 2 * 2000 // 256)
+        self.assertEqual(0, CountMinSketch().estimate("key1"))
+        sketch.halve()
+        self.assertEqual(estimate // 2, sketch.estimate("hot"))
+
+
+class HeavyHittersTest(unittest.TestCase):
+
+    def test_most_common(self):
+        hitters = HeavyHitters(size=3, decay_interval=0)
+        for i in range(2000):
+            hitters.add("key%d" % i)
+            if i % 4 == 0:
+                hitters.add("a")
+            if i % 10 == 0:
+                hitters.add("b")
+        self.assertEqual(["a", "b"], [item for item, _ in hitters.most_common(2)])
+        self.assertEqual(500, hitters.most_common(1)[0][1])
+        self.assertIn("b", hitters)
+        self.assertEqual(3, len(hitters.top))
+
+    def test_decay(self):
+        hitters = HeavyHitters(size=3, decay_interval=60)
+        for _ in range(10):
+            hitters.add("a")
+        with mock.patch("time.time", return_value=time.time() + 61):
+            self.assertEqual(6, hitters.add("a"))
+        self.assertEqual([("a", 6)], hitters.most_common())
@@ -0,0 +1,477 @@
+import asyncio
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from limits import RateLimitItemPerMinute, RateLimitItemPerSecond
+from limits.errors import ConfigurationError
+from limits.storage import MemoryStorage
+
+from sanic_limiter.keys import CompactKeyLimiter, CompactKeys
+from sanic_limiter.storage import (
+    AsyncBoundedMemoryStorage, AsyncMemoryStorage, AsyncShardedStorage,
+    AsyncSharedMemoryStorage, HashRing, LocalCounterStorage, storage_from_string
+)
+from sanic_limiter.strategies import (
+    AsyncFixedWindowRateLimiter, AsyncGCRARateLimiter, AsyncMovingWindowRateLimiter,
+    AsyncSlidingWindowCounterRateLimiter
+)
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def hit_shared(path, hits):
+    storage = AsyncSharedMemoryStorage('async+shm://' + path)
+    for _ in range(hits):
+        run(storage.incr('k', 60))
+
+
+class AsyncStorageTest(unittest.TestCase):
+
+    def test_storage_from_string(self):
+        self.assertTrue(isinstance(storage_from_string('async+memory://'), AsyncMemoryStorage))
+        self.assertTrue(isinstance(storage_from_string('memory://'), MemoryStorage))
+        self.assertRaises(ConfigurationError, storage_from_string, 'bogus://')
+
+    def test_memory_incr(self):
+        storage = AsyncMemoryStorage()
+        self.assertEqual(1, run(storage.incr('k', 1)))
+        self.assertEqual(2, run(storage.incr('k', 1)))
+        self.assertEqual(2, run(storage.get('k')))
+        self.assertTrue(run(storage.get_expiry('k')) <= int(time.time() + 1))
+        run(storage.clear('k'))
+        self.assertEqual(0, run(storage.get('k')))
+
+    def test_memory_expiry(self):
+        storage = AsyncMemoryStorage()
+        run(storage.incr('k', 0))
+        self.assertEqual(0, run(storage.get('k')))
+
+    def test_fixed_window(self):
+        storage = AsyncMemoryStorage()
+        limiter = AsyncFixedWindowRateLimiter(storage)
+        limit = RateLimitItemPerMinute(2)
+        self.assertTrue(run(limiter.hit(limit, 'a')))
+        self.assertTrue(run(limiter.hit(limit, 'a')))
+        self.assertFalse(run(limiter.hit(limit, 'a')))
+        self.assertTrue(run(limiter.hit(limit, 'b')))
+        self.assertEqual(0, run(limiter.get_window_stats(limit, 'a'))[1])
+
+    def test_moving_window(self):
+        storage = AsyncMemoryStorage()
+        limiter = AsyncMovingWindowRateLimiter(storage)
+        limit = RateLimitItemPerSecond(2)
+        self.assertTrue(run(limiter.hit(limit, 'a')))
+        self.assertTrue(run(limiter.test(limit, 'a')))
+        self.assertTrue(run(limiter.hit(limit, 'a')))
+        self.assertFalse(run(limiter.hit(limit, 'a')))
+        self.assertFalse(run(limiter.test(limit, 'a')))
+        self.assertEqual(0, run(limiter.get_window_stats(limit, 'a'))[1])
+        run(storage.reset())
+        self.assertTrue(run(limiter.hit(limit, 'a')))
+
+    def test_memory_incr_many(self):
+        storage = AsyncMemoryStorage()
+        self.assertEqual(None, run(storage.incr_many([('a', 60, 1), ('b', 60, 2)])))
+        self.assertEqual(1, run(storage.incr_many([('b', 60, 2), ('a', 60, 1)])))
+        self.assertEqual(1, run(storage.get('a')))
+        self.assertEqual(1, run(storage.get('b')))
+
+    def test_hit_many(self):
+        storage = AsyncMemoryStorage()
+        for limiter in (AsyncFixedWindowRateLimiter(storage), AsyncMovingWindowRateLimiter(storage)):
+            run(storage.reset())
+            minute, hour = RateLimitItemPerMinute(1), RateLimitItemPerMinute(5, 60)
+            hits = [(hour, ('k',)), (minute, ('k',))]
+            self.assertEqual(None, run(limiter.hit_many(hits)))
+            self.assertEqual(1, run(limiter.hit_many(hits)))
+            self.assertEqual(4, run(limiter.get_window_stats(hour, 'k'))[1])
+
+    def test_hit_many_with_stats(self):
+        for storage in (AsyncMemoryStorage(), AsyncBoundedMemoryStorage()):
+            for limiter in (AsyncFixedWindowRateLimiter(storage), AsyncMovingWindowRateLimiter(storage)):
+                run(storage.reset())
+                minute, hour = RateLimitItemPerMinute(1), RateLimitItemPerMinute(5, 60)
+                hits = [(hour, ('k',)), (minute, ('k',))]
+                with mock.patch.object(limiter, 'get_window_stats') as get_window_stats:
+                    index, stats = run(limiter.hit_many_with_stats(hits))
+                    self.assertEqual(None, index)
+                    self.assertEqual([4, 0], [remaining for _, remaining in stats])
+                    for reset, _ in stats:
+                        self.assertTrue(time.time() < reset <= time.time() + 3601)
+                    index, stats = run(limiter.hit_many_with_stats(hits, [2, 1]))
+                    self.assertEqual(1, index)
+                    self.assertEqual([4, 0], [remaining for _, remaining in stats])
+                    self.assertFalse(get_window_stats.called)
+
+    def test_hit_with_stats(self):
+        for storage in (AsyncMemoryStorage(), AsyncBoundedMemoryStorage()):
+            for limiter in (AsyncFixedWindowRateLimiter(storage), AsyncMovingWindowRateLimiter(storage)):
+                run(storage.reset())
+                limit = RateLimitItemPerMinute(2)
+                allowed, reset, remaining = run(limiter.hit_with_stats(limit, 'k'))
+                self.assertTrue(allowed)
+                self.assertEqual(1, remaining)
+                self.assertTrue(time.time() < reset <= time.time() + 61)
+                self.assertEqual((True, reset, 0), run(limiter.hit_with_stats(limit, 'k')))
+                self.assertEqual((False, reset, 0), run(limiter.hit_with_stats(limit, 'k')))
+                self.assertEqual((reset, 0), run(limiter.get_window_stats(limit, 'k')))
+                # costly hits read the window in the same call too
+                with mock.patch.object(limiter, 'get_window_stats') as get_window_stats:
+                    allowed, _, remaining = run(limiter.hit_with_stats(limit, 'c', cost=3))
+                    self.assertEqual((False, 2), (allowed, remaining))
+                    allowed, reset, remaining = run(limiter.hit_with_stats(limit, 'c', cost=2))
+                    self.assertEqual((True, 0), (allowed, remaining))
+                    self.assertTrue(time.time() < reset <= time.time() + 61)
+                    self.assertFalse(get_window_stats.called)
+
+    def test_gcra(self):
+        for storage in (AsyncMemoryStorage(), AsyncBoundedMemoryStorage()):
+            limiter = AsyncGCRARateLimiter(storage)
+            limit = RateLimitItemPerMinute(3)
+            self.assertTrue(run(limiter.test(limit, 'k')))
+            self.assertEqual(3, run(limiter.get_window_stats(limit, 'k'))[1])
+            self.assertEqual((True, 2), run(limiter.hit_with_stats(limit, 'k'))[::2])
+            self.assertTrue(run(limiter.hit(limit, 'k')))
+            self.assertTrue(run(limiter.hit(limit, 'k')))
+            allowed, reset, remaining = run(limiter.hit_with_stats(limit, 'k'))
+            self.assertEqual((False, 0), (allowed, remaining))
+            self.assertTrue(time.time() + 18 < reset <= time.time() + 20)
+            self.assertFalse(run(limiter.test(limit, 'k')))
+            self.assertTrue(run(limiter.hit(limit, 'other')))
+            run(limiter.clear(limit, 'k'))
+            self.assertTrue(run(limiter.hit(limit, 'k')))
+
+    def test_gcra_emission_interval(self):
+        storage = AsyncMemoryStorage()
+        with mock.patch('time.time', return_value=1000):
+            run(storage.reset())
+            self.assertEqual((True, 1000.5), run(storage.gcra_acquire('k', 0.5, 1)))
+            self.assertEqual((True, 1001.0), run(storage.gcra_acquire('k', 0.5, 1)))
+            self.assertEqual((False, 1001.0), run(storage.gcra_acquire('k', 0.5, 1)))
+        with mock.patch('time.time', return_value=1000.5):
+            self.assertEqual((True, 1001.5), run(storage.gcra_acquire('k', 0.5, 1)))
+
+    def test_sliding_window_counter(self):
+        for storage in (AsyncMemoryStorage(), AsyncBoundedMemoryStorage()):
+            limiter = AsyncSlidingWindowCounterRateLimiter(storage)
+            limit = RateLimitItemPerMinute(4)
+            with mock.patch('time.time', return_value=6000.0):
+                for _ in range(4):
+                    self.assertTrue(run(limiter.hit(limit, 'k')))
+                self.assertFalse(run(limiter.hit(limit, 'k')))
+                self.assertEqual((6060, 0), run(limiter.get_window_stats(limit, 'k')))
+            # a quarter into the next window three quarters of the previous
+            # window still count
+            with mock.patch('time.time', return_value=6075.0):
+                self.assertEqual((6120, 1), run(limiter.get_window_stats(limit, 'k')))
+                self.assertEqual((True, 6090, 0), run(limiter.hit_with_stats(limit, 'k')))
+                self.assertFalse(run(limiter.test(limit, 'k')))
+                run(limiter.clear(limit, 'k'))
+                self.assertTrue(run(limiter.test(limit, 'k')))
+
+    def test_hit_cost(self):
+        for storage in (AsyncMemoryStorage(), AsyncBoundedMemoryStorage()):
+            for limiter in (
+                AsyncFixedWindowRateLimiter(storage), AsyncMovingWindowRateLimiter(storage),
+                AsyncGCRARateLimiter(storage), AsyncSlidingWindowCounterRateLimiter(storage)
+            ):
+                run(storage.reset())
+                limit = RateLimitItemPerMinute(5)
+                self.assertTrue(run(limiter.hit(limit, 'k', cost=3)))
+                # an exceeding hit does not consume its cost
+                self.assertFalse(run(limiter.hit(limit, 'k', cost=3)))
+                self.assertEqual(2, run(limiter.get_window_stats(limit, 'k'))[1])
+                self.assertEqual((True, 0), run(limiter.hit_with_stats(limit, 'k', cost=2))[::2])
+                self.assertFalse(run(limiter.hit(limit, 'k')))
+                hits = [(limit, ('a',)), (limit, ('b',))]
+                self.assertEqual(None, run(limiter.hit_many(hits, [2, 5])))
+                self.assertEqual(1, run(limiter.hit_many(hits, [1, 1])))
+                # only fixed and moving windows hit several limits atomically
+                remaining = 2 if isinstance(limiter, (
+                    AsyncGCRARateLimiter, AsyncSlidingWindowCounterRateLimiter
+                )) else 3
+                self.assertEqual(remaining, run(limiter.get_window_stats(limit, 'a'))[1])
+
+    def test_memory_leases(self):
+        storage = AsyncMemoryStorage()
+        first = run(storage.acquire_lease('k', 2, 10))
+        second = run(storage.acquire_lease('k', 2, 10))
+        self.assertIsNotNone(second)
+        self.assertIsNone(run(storage.acquire_lease('k', 2, 10)))
+        run(storage.release_lease('k', first))
+        self.assertIsNotNone(run(storage.acquire_lease('k', 2, 10)))
+        # leases which were never released expire
+        with mock.patch('time.time', return_value=time.time() + 11):
+            self.assertIsNotNone(run(storage.acquire_lease('k', 2, 10)))
+            self.assertEqual(1, len(storage.leases['k']))
+
+    def test_compact_keys(self):
+        keys = CompactKeys()
+        scope = "/api/v1/users/42/orders:GET"
+        for cls in (
+            AsyncFixedWindowRateLimiter, AsyncMovingWindowRateLimiter,
+            AsyncGCRARateLimiter, AsyncSlidingWindowCounterRateLimiter
+        ):
+            storage = AsyncMemoryStorage()
+            limiter = CompactKeyLimiter(cls(storage), keys)
+            limit = RateLimitItemPerMinute(2)
+            self.assertTrue(run(limiter.hit(limit, "2001:db8::1", scope)))
+            self.assertTrue(run(limiter.hit(limit, "2001:db8::1", scope)))
+            self.assertFalse(run(limiter.hit(limit, "2001:db8::1", scope)))
+            self.assertEqual(0, run(limiter.get_window_stats(limit, "2001:db8::1", scope))[1])
+            self.assertIsNone(run(limiter.hit_many([(limit, ("2001:db8::2", scope))])))
+            stored = set(storage.storage) | set(storage.events)
+            self.assertEqual(2, len(stored), cls)
+            # the window suffix of the sliding window counter is appended
+            self.assertTrue(all(len(key) <= keys.length + 12 for key in stored), stored)
+        short = RateLimitItemPerMinute(2).key_for("k", "/t1")
+        self.assertEqual(short, keys.encode(short, "k", "/t1"))
+        self.assertEqual(keys.length, len(keys.encode("LIMITER/" + "k" * 100, "k", "/t1")))
+        self.assertNotEqual(
+            keys.encode("LIMITER/" + "k" * 100, "k", "/t1"),
+            keys.encode("LIMITER/" + "k" * 100, "k", "/t2")
+        )
+
+    def test_local_counter(self):
+        shared = AsyncMemoryStorage()
+        storage = LocalCounterStorage(shared, sync_interval=60, sync_hits=3)
+        self.assertEqual(1, run(storage.incr('k', 60)))
+        self.assertEqual(1, run(shared.get('k')))
+        self.assertEqual(2, run(storage.incr('k', 60)))
+        self.assertEqual(3, run(storage.incr('k', 60)))
+        self.assertEqual(1, run(shared.get('k')))
+        run(shared.incr('k', 60))
+        self.assertEqual(5, run(storage.incr('k', 60)))
+        self.assertEqual(5, run(shared.get('k')))
+        self.assertEqual(6, run(storage.incr('k', 60)))
+        run(storage.sync())
+        self.assertEqual(6, run(shared.get('k')))
+        # a costly hit exceeding the limit consumes nothing
+        limiter = AsyncFixedWindowRateLimiter(storage)
+        limit = RateLimitItemPerMinute(5)
+        self.assertTrue(run(limiter.hit(limit, 'c', cost=4)))
+        self.assertFalse(run(limiter.hit(limit, 'c', cost=2)))
+        self.assertTrue(run(limiter.hit(limit, 'c', cost=1)))
+        self.assertEqual(0, run(limiter.get_window_stats(limit, 'c'))[1])
+        index, stats = run(limiter.hit_many_with_stats([(limit, ('c',)), (limit, ('d',))]))
+        self.assertEqual(0, index)
+        self.assertEqual(0, stats[0][1])
+
+    def test_bounded_memory(self):
+        storage = storage_from_string('async+memory+lru://', max_entries=2)
+        self.assertTrue(isinstance(storage, AsyncBoundedMemoryStorage))
+        run(storage.incr('a', 60))
+        run(storage.incr('b', 60))
+        run(storage.incr('a', 60))
+        run(storage.incr('c', 60))
+        self.assertEqual(2, run(storage.get('a')))
+        self.assertEqual(0, run(storage.get('b')))
+        self.assertEqual(1, run(storage.get('c')))
+        self.assertEqual(1, storage.stats()['evictions'])
+        self.assertEqual(2, sum(len(keys) for keys in storage.wheel.values()))
+
+    def test_bounded_memory_expiry(self):
+        storage = AsyncBoundedMemoryStorage(max_entries=10)
+        limiter = AsyncMovingWindowRateLimiter(storage)
+        limit = RateLimitItemPerSecond(1)
+        self.assertTrue(run(limiter.hit(limit, 'a')))
+        self.assertFalse(run(limiter.hit(limit, 'a')))
+        run(storage.incr('b', 1))
+        storage.cursor -= 5
+        with mock.patch('time.time', return_value=time.time() + 2):
+            self.assertEqual(0, run(storage.get('b')))
+            self.assertTrue(run(limiter.hit(limit, 'a')))
+        self.assertEqual({'entries': 1, 'max_entries': 10, 'evictions': 0, 'expirations': 2}, storage.stats())
+        self.assertEqual(1, sum(len(keys) for keys in storage.wheel.values()))
+
+
+class SharedMemoryStorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.uri = 'async+shm://' + os.path.join(self.directory, 'limits')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_shared_between_instances(self):
+        storage = storage_from_string(self.uri, slots=64, ways=4)
+        other = storage_from_string(self.uri, slots=64, ways=4)
+        self.assertTrue(isinstance(storage, AsyncSharedMemoryStorage))
+        self.assertEqual(1, run(storage.incr('k', 60)))
+        self.assertEqual(2, run(other.incr('k', 60)))
+        self.assertEqual(2, run(storage.get('k')))
+        value, expiry = run(other.incr_with_expiry('k', 60))
+        self.assertEqual(3, value)
+        self.assertEqual(int(expiry), run(storage.get_expiry('k')))
+        run(other.clear('k'))
+        self.assertEqual(0, run(storage.get('k')))
+        self.assertEqual(None, run(storage.incr_many([('a', 60, 1), ('b', 60, 2)])))
+        self.assertEqual(1, run(other.incr_many([('b', 60, 2), ('a', 60, 1)])))
+        self.assertEqual(1, run(other.get('b')))
+        index, windows = run(other.incr_many_with_expiry([('a', 60, 2), ('b', 60, 2)]))
+        self.assertEqual(None, index)
+        self.assertEqual([2, 2], [value for value, _ in windows])
+        self.assertEqual(run(storage.get_expiry('b')), int(windows[1][1]))
+        run(storage.reset())
+        self.assertEqual(0, run(other.get('a')))
+        self.assertRaises(ConfigurationError, storage_from_string, self.uri, slots=128)
+
+    def test_expiry_and_eviction(self):
+        storage = storage_from_string(self.uri, slots=4, ways=4)
+        run(storage.incr('expired', 0))
+        self.assertEqual(0, run(storage.get('expired')))
+        for key in 'abcd':
+            run(storage.incr(key, 60))
+        self.assertEqual(0, storage.stats()['evictions'])
+        run(storage.incr('e', 60))
+        self.assertEqual(1, storage.stats()['evictions'])
+        self.assertEqual(1, run(storage.get('e')))
+        self.assertEqual(0, run(storage.get('a')))
+        self.assertEqual(1, run(storage.get('d')))
+
+    def test_strategies(self):
+        storage = storage_from_string(self.uri)
+        for limiter in (
+            AsyncFixedWindowRateLimiter(storage), AsyncGCRARateLimiter(storage),
+            AsyncSlidingWindowCounterRateLimiter(storage)
+        ):
+            limit = RateLimitItemPerMinute(2)
+            self.assertTrue(run(limiter.hit(limit, 'k')))
+            self.assertTrue(run(limiter.hit(limit, 'k')))
+            self.assertFalse(run(limiter.hit(limit, 'k')))
+            self.assertEqual(0, run(limiter.get_window_stats(limit, 'k'))[1])
+            run(storage.reset())
+
+    def test_close(self):
+        storage = storage_from_string(self.uri)
+        run(storage.incr('k', 60))
+        fd, table = storage._fd, storage.map
+        run(storage.close())
+        self.assertTrue(table.closed)
+        self.assertRaises(OSError, os.fstat, fd)
+        run(storage.close())
+        # opened again when used afterwards
+        self.assertEqual(2, run(storage.incr('k', 60)))
+        run(storage.close())
+        self.assertTrue(run(storage.check()))
+        run(storage.close())
+
+    def test_worker_processes(self):
+        storage = storage_from_string(self.uri)
+        path = storage.path
+        workers = [
+            multiprocessing.Process(target=hit_shared, args=(path, 200))
+            for _ in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(800, run(storage.get('k')))
+
+
+class ShardedStorageTest(unittest.TestCase):
+    uris = ['async+memory://a', 'async+memory://b', 'async+memory://c']
+
+    def test_ring(self):
+        ring = HashRing(['a', 'b', 'c', 'd'])
+        keys = ['LIMITER/10.0.0.%d/route/%d' % (i % 256, i) for i in range(4000)]
+        before = dict((key, ring.node_for(key)) for key in keys)
+        self.assertEqual(set('abcd'), set(before.values()))
+        ring.add('e')
+        after = dict((key, ring.node_for(key)) for key in keys)
+        moved = [key for key in keys if before[key] != after[key]]
+        # only the keys taken over by the new node move
+        self.assertEqual(set('e'), set(after[key] for key in moved))
+        self.assertTrue(0.1 < len(moved) / float(len(keys)) < 0.3)
+        ring.remove('e')
+        self.assertEqual(before, dict((key, ring.node_for(key)) for key in keys))
+        self.assertRaises(ValueError, ring.add, 'a')
+        self.assertRaises(LookupError, HashRing().node_for, 'k')
+
+    def test_routing(self):
+        storage = storage_from_string(self.uris)
+        self.assertTrue(isinstance(storage, AsyncShardedStorage))
+        for i in range(30):
+            run(storage.incr('k%d' % i, 60))
+        for i in range(30):
+            key = 'k%d' % i
+            self.assertEqual(1, run(storage.get(key)))
+            self.assertEqual(
+                [storage.node(key)],
+                [node for node in storage.nodes.values() if node.storage.get(key)]
+            )
+        self.assertTrue(len(set(storage.node('k%d' % i) for i in range(30))) > 1)
+        # both windows of the sliding window counter are on the same node
+        self.assertTrue(storage.node('k/41') is storage.node('k/42'))
+        self.assertTrue(run(storage.check()))
+        run(storage.reset())
+        self.assertEqual(0, run(storage.get('k0')))
+
+    def test_configuration(self):
+        self.assertRaises(ConfigurationError, storage_from_string, [])
+        self.assertRaises(
+            ConfigurationError, storage_from_string, ['async+memory://', 'memory://']
+        )
+        self.assertRaises(
+            ConfigurationError, storage_from_string, ['async+memory://', 'async+memory://']
+        )
+        # operations are only available if all nodes support them
+        storage = storage_from_string(self.uris)
+        self.assertTrue(hasattr(storage, 'acquire_entry'))
+        shared = AsyncShardedStorage.__new__(AsyncShardedStorage)
+        shared.nodes = {'a': AsyncMemoryStorage(), 'b': LocalCounterStorage(AsyncMemoryStorage())}
+        self.assertFalse(hasattr(shared, 'acquire_entry'))
+
+    def test_strategies(self):
+        storage = storage_from_string(self.uris)
+        for limiter in (
+            AsyncFixedWindowRateLimiter(storage), AsyncMovingWindowRateLimiter(storage),
+            AsyncGCRARateLimiter(storage), AsyncSlidingWindowCounterRateLimiter(storage)
+        ):
+            limit = RateLimitItemPerMinute(2)
+            self.assertTrue(run(limiter.hit(limit, 'k')))
+            self.assertTrue(run(limiter.hit(limit, 'k')))
+            self.assertFalse(run(limiter.hit(limit, 'k')))
+            self.assertEqual(0, run(limiter.get_window_stats(limit, 'k'))[1])
+            run(storage.reset())
+
+    def test_batch_spanning_nodes(self):
+        storage = storage_from_string(self.uris)
+        limit = RateLimitItemPerMinute(1)
+        keys = []
+        for i in range(100):
+            if storage.node(limit.key_for('k%d' % i)) not in [
+                storage.node(limit.key_for(key)) for key in keys
+            ]:
+                keys.append('k%d' % i)
+        self.assertEqual(3, len(keys))
+        for limiter in (
+            AsyncFixedWindowRateLimiter(storage), AsyncMovingWindowRateLimiter(storage)
+        ):
+            hits = [(limit, (key,)) for key in keys]
+            self.assertEqual(None, run(limiter.hit_many(hits)))
+            run(limiter.clear(limit, keys[1]))
+            self.assertEqual(1, run(limiter.hit_many(hits[1:])))
+            # the batch is atomic per node only
+            self.assertFalse(run(limiter.test(limit, keys[1])))
+            run(storage.reset())
+            # the windows of every node are returned in the order of the hits
+            two = RateLimitItemPerMinute(2)
+            self.assertEqual(None, run(limiter.hit_many([(two, (keys[1],))], [2])))
+            index, stats = run(limiter.hit_many_with_stats([(two, (key,)) for key in keys]))
+            self.assertEqual(1, index)
+            self.assertEqual([1, 0, 1], [remaining for _, remaining in stats])
+            run(storage.reset())
@@ -0,0 +1,62 @@
+import unittest
+from unittest import mock
+
+from sanic_limiter.util import AddressSet, RemoteAddress
+
+
+def request(ip, forwarded_for=None):
+    headers = {}
+    if forwarded_for is not None:
+        headers["X-Forwarded-For"] = forwarded_for
+    return mock.Mock(ip=ip, headers=headers, remote_addr=forwarded_for or "")
+
+
+class AddressSetTest(unittest.TestCase):
+
+    def test_contains(self):
+        addresses = AddressSet(["10.0.0.0/8", "192.168.1.7", "2001:db8::/32"])
+        self.assertIn("10.1.2.3", addresses)
+        self.assertIn("192.168.1.7", addresses)
+        self.assertNotIn("192.168.1.8", addresses)
+        self.assertNotIn("11.0.0.1", addresses)
+        self.assertIn("2001:db8:1::1", addresses)
+        self.assertNotIn("2001:db9::1", addresses)
+        # ipv4 mapped ipv6 addresses are looked up as ipv4
+        self.assertIn("::ffff:10.0.0.1", addresses)
+        self.assertNotIn("not an address", addresses)
+        self.assertNotIn(None, addresses)
+
+    def test_covered_networks(self):
+        addresses = AddressSet(["10.1.0.0/16", "10.0.0.0/8", "10.2.0.0/16"])
+        self.assertIn("10.255.0.1", addresses)
+        self.assertEqual(3, len(addresses))
+        self.assertIn("::1", AddressSet(["::/0"]))
+        self.assertNotIn("127.0.0.1", AddressSet(["::/0"]))
+        with self.assertRaises(ValueError):
+            AddressSet(["10.0.0.0/33"])
+
+
+class RemoteAddressTest(unittest.TestCase):
+
+    def test_prefixes(self):
+        key_func = RemoteAddress()
+        self.assertEqual("203.0.113.9", key_func(request("203.0.113.9")))
+        self.assertEqual(
+            "2001:db8:1:2::/64", key_func(request("2001:db8:1:2:aaaa::1"))
+        )
+        key_func = RemoteAddress(ipv4_prefix=24, ipv6_prefix=48)
+        self.assertEqual("203.0.113.0/24", key_func(request("203.0.113.9")))
+        self.assertEqual("2001:db8:1::/48", key_func(request("2001:db8:1:2::1")))
+        self.assertEqual("203.0.113.0/24", key_func(request("::ffff:203.0.113.9")))
+
+    def test_trusted_proxies(self):
+        key_func = RemoteAddress(trusted_proxies=["10.0.0.0/8"])
+        # the header of untrusted peers is ignored
+        self.assertEqual("203.0.113.9", key_func(request("203.0.113.9", "1.2.3.4")))
+        self.assertEqual(
+            "1.2.3.4", key_func(request("10.0.0.1", "6.6.6.6, 1.2.3.4, 10.0.0.2"))
+        )
+        self.assertEqual("10.0.0.1", key_func(request("10.0.0.1")))
+        self.assertEqual("10.0.0.2", key_func(request("10.0.0.1", "spoofed, 10.0.0.2")))
+        # the raw address is used when the peer is unknown
+        self.assertEqual("", key_func(request(None)))